@@ -1,24 +1,45 @@
 import os
+import logging
+import orjson
 import asyncio
-from fastapi import FastAPI, UploadFile, File, HTTPException, Depends, status, Path
+import hashlib
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, UploadFile, File, HTTPException, Depends, status, Path, Query, BackgroundTasks
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse
 from dotenv import load_dotenv
 from typing import List
 
 # Import services and models
-from services.supabase_service import SupabaseService
-from services.gemini_service import GeminiService
+from services.supabase_service import SupabaseService, get_supabase_service
+from services.db_pool import get_pool, close_pool
+from services.gemini_service import GeminiService, ANSWER_UNAVAILABLE, ContextCacheExpired, get_gemini_service
 from services.document_processor import DocumentProcessor
-from services.gemini_agent_service import GeminiAgentService # NEW: Import the agent service
-from models.requests import QuestionRequest, SemanticSearchRequest, UploadPDFResponse, Entity, AgentQueryRequest, AgentQueryResponse, DocumentListItem
+from services.gemini_agent_service import GeminiAgentService, get_gemini_agent_service # NEW: Import the agent service
+from services.cache import SemanticCache
+from models.requests import QuestionRequest, SemanticSearchRequest, UploadPDFResponse, Entity, AgentQueryRequest, AgentQueryResponse, DocumentListItem, DocumentStatusResponse
 
 # Load environment variables
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """
+    Opens long-lived database connections and creates the service singletons on startup,
+    so the first request doesn't pay for setup. Closes the connections on shutdown.
+    """
+    app.state.pool = await get_pool()
+    get_gemini_agent_service() # Also creates the Supabase and Gemini services
+    yield
+    await close_pool()
+
 app = FastAPI(
     title="DocuMate AI Backend",
     description="FastAPI backend for DocuMate AI, integrating Gemini and Supabase.",
     version="0.1.0",
+    lifespan=lifespan,
 )
 
 # --- CORS Configuration ---
@@ -38,11 +59,11 @@ app.add_middleware(
 )
 
 # --- Service Initialization ---
-# These services are initialized once when the FastAPI app starts
-supabase_service = SupabaseService()
-gemini_service = GeminiService()
+# The Supabase, Gemini and agent services are process-wide singletons (see their
+# get_*_service factories), injected into endpoints with Depends
 document_processor = DocumentProcessor()
-gemini_agent_service = GeminiAgentService(supabase_service, gemini_service) # NEW: Initialize agent service
+# Answers per document, reused for questions with near-identical meaning
+answer_cache = SemanticCache(maxsize=1000, threshold=0.95, ttl=60 * 60)
 
 # --- Dependency for User ID (Placeholder for Auth) ---
 async def get_current_user_id():
@@ -58,17 +79,132 @@ async def get_current_user_id():
         )
     return dummy_id
 
+# --- Chunk Ingestion Pipeline ---
+# Chunks are embedded and stored batch by batch. At most CHUNK_QUEUE_SIZE embedded
+# batches wait for the database at once, which bounds memory for large documents.
+CHUNK_BATCH_SIZE = 100
+CHUNK_QUEUE_SIZE = 8
+
+async def _embed_and_store_chunks(document_id: str, chunks: List[str]):
+    """
+    Generates embeddings for the chunks and inserts them into Supabase as a
+    producer/consumer pipeline, so inserts overlap with the remaining embedding calls.
+    """
+    supabase_service = get_supabase_service()
+    gemini_service = get_gemini_service()
+    queue: asyncio.Queue = asyncio.Queue(maxsize=CHUNK_QUEUE_SIZE)
+
+    async def embed_batches():
+        for start in range(0, len(chunks), CHUNK_BATCH_SIZE):
+            batch = chunks[start:start + CHUNK_BATCH_SIZE]
+            embeddings = await gemini_service.get_embeddings_batch(batch)
+            await queue.put([
+                {
+                    "chunk_index": start + i,
+                    "chunk_text": chunk_text,
+                    "embedding": embedding
+                }
+                for i, (chunk_text, embedding) in enumerate(zip(batch, embeddings))
+            ])
+        await queue.put(None) # Signals the end of the chunks
+
+    async def store_batches():
+        while (batch := await queue.get()) is not None:
+            await supabase_service.insert_document_chunks(document_id, batch)
+
+    tasks = [asyncio.create_task(embed_batches()), asyncio.create_task(store_batches())]
+    try:
+        await asyncio.gather(*tasks)
+    finally:
+        # If either side failed, stop the other instead of leaving it blocked on the queue
+        for task in tasks:
+            task.cancel()
+
+async def _index_document_chunks(document_id: str, cleaned_text: str):
+    """
+    Chunks, embeds and stores the document text. If identical text was indexed
+    before, its chunks and embeddings are copied instead, skipping chunking and
+    the Gemini calls entirely.
+    Runs as a background task after /upload-pdf has responded.
+    """
+    supabase_service = get_supabase_service()
+    try:
+        content_hash = hashlib.blake2b(cleaned_text.encode(), digest_size=16).hexdigest()
+        cached_document_id = await supabase_service.get_cached_document_id(content_hash)
+        if cached_document_id and await supabase_service.copy_document_chunks(cached_document_id, document_id):
+            await supabase_service.set_index_status(document_id, "ready")
+            return
+
+        chunks = await asyncio.to_thread(document_processor.chunk_text, cleaned_text)
+        await _embed_and_store_chunks(document_id, chunks)
+        await supabase_service.cache_document_text(content_hash, document_id)
+        # Only now are all chunks stored; a document without text is ready with no chunks
+        await supabase_service.set_index_status(document_id, "ready")
+    except Exception as e:
+        logger.exception("Error indexing chunks for document %s: %s", document_id, e)
+        await supabase_service.set_index_status(document_id, "failed")
+
+async def _cache_document_context(document_id: str, cleaned_text: str):
+    """
+    Stores the document text in a Gemini context cache and records its name, so
+    /ask-question can answer without resending the document. Documents below the
+    caching minimum are skipped. Runs as a background task after /upload-pdf has responded.
+    """
+    cache_name = await get_gemini_service().create_context_cache(cleaned_text)
+    if cache_name:
+        await get_supabase_service().set_context_cache_name(document_id, cache_name)
+
+async def _cache_answer_if_indexed(document_id: str, query_embedding: list[float], answer: str):
+    """
+    Caches an answer for similar future questions, but only once the document is fully
+    indexed, so answers drawn from a partial index are never reused.
+    Runs as a background task after /ask-question has responded.
+    """
+    try:
+        if await get_supabase_service().get_index_status(document_id) == "ready":
+            answer_cache.store(document_id, query_embedding, answer)
+    except Exception as e:
+        logger.exception("Error caching answer for document %s: %s", document_id, e)
+
+async def _require_indexed(supabase_service: SupabaseService, document_id: str):
+    """
+    Raises unless the document's chunks are fully indexed, so a search over a missing or
+    partial index is reported as such instead of looking like a genuine miss.
+    """
+    index_status = await supabase_service.get_index_status(document_id)
+    if index_status is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Document {document_id} not found")
+    if index_status == "indexing":
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail="The document is still being indexed. Please try again in a moment."
+        )
+    if index_status == "failed":
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail="Indexing this document failed. Please upload it again."
+        )
+
+def _sse(event: dict) -> str:
+    """Formats an event as a Server-Sent Events message."""
+    return f"data: {orjson.dumps(event).decode()}\n\n"
+
 # --- API Endpoints ---
 
 @app.post("/upload-pdf", response_model=UploadPDFResponse, summary="Upload and Process PDF Document")
 async def upload_pdf(
+    background_tasks: BackgroundTasks,
     file: UploadFile = File(..., description="The PDF file to upload and process."),
-    user_id: str = Depends(get_current_user_id) # Get user ID from auth
+    user_id: str = Depends(get_current_user_id), # Get user ID from auth
+    supabase_service: SupabaseService = Depends(get_supabase_service),
+    gemini_service: GeminiService = Depends(get_gemini_service)
 ):
     """
     Uploads a PDF document, extracts its text, generates a summary,
     identifies key entities, and prepares it for intelligent Q&A and search.
     All data is stored securely in Supabase.
+    Chunk indexing for Q&A and search continues after the response is sent;
+    poll /documents/{document_id}/status until it reports "ready".
     """
     if not file.filename:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="No file name provided.")
@@ -76,42 +212,36 @@ async def upload_pdf(
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Only PDF files are allowed.")
 
     try:
-        pdf_content = await file.read()
-        
         # 1. Extract text from PDF
-        extracted_text = document_processor.extract_text_from_pdf(pdf_content)
-        cleaned_text = document_processor.clean_text(extracted_text)
+        # The upload is already spooled to a temporary file, so parse it from there
+        # rather than copying it into memory first.
+        # Parsing is CPU-bound, so run it in a worker thread to keep the event loop free
+        await file.seek(0)
+        extracted_text = await asyncio.to_thread(document_processor.extract_text_from_pdf, file.file)
+        cleaned_text = await asyncio.to_thread(document_processor.clean_text, extracted_text)
+
+        # 2. Start every step that only needs the text, so they all run concurrently:
+        # storage upload of the original PDF and Gemini summary and entities
+        # The storage client only accepts bytes or a file path, so read the bytes here
+        await file.seek(0)
+        pdf_content = await file.read()
 
-        # 2. Upload original PDF to Supabase Storage
-        storage_path = await supabase_service.upload_pdf_to_storage(file.filename, pdf_content, user_id)
-        
-        # 3. Generate Summary and Entities using Gemini concurrently
-        # This speeds up the response by running AI tasks in parallel
-        summary_task = gemini_service.generate_summary(cleaned_text)
-        entities_task = gemini_service.extract_entities(cleaned_text)
-        
-        summary, raw_entities = await asyncio.gather(summary_task, entities_task)
-
-        # 4. Process raw entities to include start/end positions for frontend highlighting
-        processed_entities: List[Entity] = []
-        for ent in raw_entities:
-            text_to_find = ent.get("text")
-            label = ent.get("label")
-            if text_to_find and label:
-                # Find first occurrence for start/end. This is a basic approach.
-                # For more robust NER, consider a dedicated library or more advanced Gemini prompting.
-                start_idx = cleaned_text.find(text_to_find)
-                if start_idx != -1:
-                    processed_entities.append(Entity(
-                        text=text_to_find,
-                        label=label,
-                        start=start_idx,
-                        end=start_idx + len(text_to_find)
-                    ))
-                else:
-                    processed_entities.append(Entity(text=text_to_find, label=label))
+        storage_task = asyncio.create_task(supabase_service.upload_pdf_to_storage(file.filename, pdf_content, user_id))
+        summary_task = asyncio.create_task(gemini_service.generate_summary(cleaned_text))
+        entities_task = asyncio.create_task(gemini_service.extract_entities(cleaned_text))
+
+        # 3. Process raw entities to include start/end positions for frontend highlighting,
+        # while the other tasks are still in flight.
+        # Uses the first occurrence of each entity. This is a basic approach.
+        # For more robust NER, consider a dedicated library or more advanced Gemini prompting.
+        raw_entities = await entities_task
+        processed_entities: List[Entity] = [
+            Entity(**ent) for ent in document_processor.locate_entities(cleaned_text, raw_entities)
+        ]
 
-        # 5. Insert document metadata (including summary and entities) into Supabase DB
+        storage_path, summary = await asyncio.gather(storage_task, summary_task)
+
+        # 4. Insert document metadata (including summary and entities) into Supabase DB
         document_id = await supabase_service.insert_document_metadata(
             user_id=user_id,
             filename=file.filename,
@@ -120,17 +250,10 @@ async def upload_pdf(
             entities=[e.model_dump(mode='json') for e in processed_entities] # Store as JSONB
         )
 
-        # 6. Chunk text and generate embeddings for RAG and Semantic Search
-        chunks = document_processor.chunk_text(cleaned_text)
-        chunk_data_to_insert = []
-        for i, chunk_text in enumerate(chunks):
-            embedding = await gemini_service.get_embedding(chunk_text)
-            chunk_data_to_insert.append({
-                "chunk_index": i,
-                "chunk_text": chunk_text,
-                "embedding": embedding
-            })
-        await supabase_service.insert_document_chunks(document_id, chunk_data_to_insert)
+        # 5. Chunk, embed and store the text for RAG and Semantic Search after responding.
+        # The client only needs the summary and entities now; chunks matter for later Q&A.
+        background_tasks.add_task(_index_document_chunks, document_id, cleaned_text)
+        background_tasks.add_task(_cache_document_context, document_id, cleaned_text)
 
         return UploadPDFResponse(
             document_id=document_id,
@@ -140,7 +263,7 @@ async def upload_pdf(
         )
 
     except Exception as e:
-        print(f"Error during PDF upload and processing: {e}")
+        logger.error("Error during PDF upload and processing: %s", e)
         # Re-raise as HTTPException to send a proper error response to the client
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
@@ -150,7 +273,10 @@ async def upload_pdf(
 @app.post("/ask-question", summary="Ask a Question about a Document (Direct RAG)")
 async def ask_question(
     request: QuestionRequest,
-    user_id: str = Depends(get_current_user_id)
+    background_tasks: BackgroundTasks,
+    user_id: str = Depends(get_current_user_id),
+    supabase_service: SupabaseService = Depends(get_supabase_service),
+    gemini_service: GeminiService = Depends(get_gemini_service)
 ):
     """
     Answers a natural language question about the content of a specific document.
@@ -159,45 +285,119 @@ async def ask_question(
     """
     try:
         # 1. Get embedding for the user's question
-        query_embedding = await gemini_service.get_embedding(request.question)
+        query_embedding = await gemini_service.get_embedding(request.question, task_type="RETRIEVAL_QUERY")
+
+        # A semantically equivalent question about this document was answered recently,
+        # so skip retrieval and generation
+        answer = answer_cache.lookup(request.document_id, query_embedding)
+        if answer is not None:
+            background_tasks.add_task(supabase_service.save_conversation, user_id, request.document_id, request.question, answer)
+            return {"answer": answer}
+
+        # 2. If the whole document is held in a Gemini context cache, answer against it;
+        # only the question is sent, so retrieval is skipped too
+        answer = None
+        cache_name = await supabase_service.get_context_cache_name(request.document_id)
+        if cache_name:
+            try:
+                answer = await gemini_service.answer_from_context_cache(request.question, cache_name)
+            except ContextCacheExpired:
+                # Forget the expired cache so no worker keeps retrying it
+                background_tasks.add_task(supabase_service.set_context_cache_name, request.document_id, None)
 
-        # 2. Retrieve relevant document chunks using vector search from Supabase
-        # This is where the 'match_document_chunks' RPC function is called
-        relevant_chunks = await supabase_service.get_relevant_chunks(request.document_id, query_embedding)
-        
-        if not relevant_chunks:
-            return {"answer": "I couldn't find relevant information in the document to answer your question. Please try rephrasing or asking a different question."}
+        if answer is None:
+            # Retrieval needs the full chunk index; the context cache above doesn't
+            await _require_indexed(supabase_service, request.document_id)
+
+            # 3. Retrieve relevant document chunks using vector search from Supabase,
+            # already combined into a single context string for Gemini
+            # This is where the 'match_document_chunks' RPC function is called
+            context = await supabase_service.get_relevant_context(request.document_id, query_embedding)
+
+            if not context:
+                return {"answer": "I couldn't find relevant information in the document to answer your question. Please try rephrasing or asking a different question."}
 
-        # Combine relevant chunks into a single context string for Gemini
-        context = "\n\n".join(relevant_chunks)
+            # Generate answer using Gemini, grounded in the retrieved context
+            answer = await gemini_service.generate_answer(request.question, context)
 
-        # 3. Generate answer using Gemini, grounded in the retrieved context
-        answer = await gemini_service.generate_answer(request.question, context)
+        if answer != ANSWER_UNAVAILABLE:
+            background_tasks.add_task(_cache_answer_if_indexed, request.document_id, query_embedding, answer)
 
-        # 4. Save conversation history for future reference
-        await supabase_service.save_conversation(user_id, request.document_id, request.question, answer)
+        # 4. Save conversation history for future reference.
+        # This runs after the response is sent, so it doesn't add to the client's wait.
+        background_tasks.add_task(supabase_service.save_conversation, user_id, request.document_id, request.question, answer)
 
         return {"answer": answer}
 
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error("Error during question answering: %s", e)
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Failed to answer question: {e}"
+        )
+
+@app.post("/ask-question/stream", summary="Ask a Question about a Document, streaming the answer")
+async def ask_question_stream(
+    request: QuestionRequest,
+    user_id: str = Depends(get_current_user_id),
+    supabase_service: SupabaseService = Depends(get_supabase_service),
+    gemini_service: GeminiService = Depends(get_gemini_service)
+):
+    """
+    Same as /ask-question, but streams the answer as Server-Sent Events
+    ({"delta": text} messages, then {"done": true}) while Gemini generates it.
+    """
+    try:
+        query_embedding, _ = await asyncio.gather(
+            gemini_service.get_embedding(request.question, task_type="RETRIEVAL_QUERY"),
+            _require_indexed(supabase_service, request.document_id)
+        )
+        context = await supabase_service.get_relevant_context(request.document_id, query_embedding)
+    except HTTPException:
+        raise
     except Exception as e:
-        print(f"Error during question answering: {e}")
+        logger.error("Error during question answering: %s", e)
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=f"Failed to answer question: {e}"
         )
 
+    async def events():
+        if not context:
+            yield _sse({"delta": "I couldn't find relevant information in the document to answer your question. Please try rephrasing or asking a different question."})
+            yield _sse({"done": True})
+            return
+        answer_parts = []
+        async for delta in gemini_service.stream_answer(request.question, context):
+            answer_parts.append(delta)
+            yield _sse({"delta": delta})
+        yield _sse({"done": True})
+        try:
+            await supabase_service.save_conversation(user_id, request.document_id, request.question, "".join(answer_parts))
+        except Exception as e:
+            logger.error("Error saving streamed conversation: %s", e)
+
+    return StreamingResponse(events(), media_type="text/event-stream")
+
 @app.post("/semantic-search", summary="Perform Semantic Search within a Document")
 async def semantic_search(
     request: SemanticSearchRequest,
-    user_id: str = Depends(get_current_user_id)
+    user_id: str = Depends(get_current_user_id),
+    supabase_service: SupabaseService = Depends(get_supabase_service),
+    gemini_service: GeminiService = Depends(get_gemini_service)
 ):
     """
     Performs a semantic search within a document based on a natural language query.
     Returns text snippets that are semantically similar to the query.
     """
     try:
-        # 1. Get embedding for the search query
-        query_embedding = await gemini_service.get_embedding(request.query)
+        # 1. Get embedding for the search query, checking the document is fully indexed meanwhile
+        query_embedding, _ = await asyncio.gather(
+            gemini_service.get_embedding(request.query, task_type="RETRIEVAL_QUERY"),
+            _require_indexed(supabase_service, request.document_id)
+        )
 
         # 2. Retrieve relevant document chunks using vector search from Supabase
         # For semantic search, we might want more chunks (e.g., top_k=10) than for Q&A context
@@ -208,8 +408,10 @@ async def semantic_search(
 
         return {"results": relevant_chunks}
 
+    except HTTPException:
+        raise
     except Exception as e:
-        print(f"Error during semantic search: {e}")
+        logger.error("Error during semantic search: %s", e)
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=f"Failed to perform semantic search: {e}"
@@ -218,7 +420,9 @@ async def semantic_search(
 @app.post("/agent-query", response_model=AgentQueryResponse, summary="Ask a Complex Query using Gemini Agent with Tools")
 async def agent_query(
     request: AgentQueryRequest,
-    user_id: str = Depends(get_current_user_id)
+    user_id: str = Depends(get_current_user_id),
+    supabase_service: SupabaseService = Depends(get_supabase_service),
+    gemini_agent_service: GeminiAgentService = Depends(get_gemini_agent_service)
 ):
     """
     Processes a complex user query using a Gemini agent that can decide to use
@@ -237,14 +441,46 @@ async def agent_query(
             final_prompt=str(agent_response.get('final_prompt')) # Convert history to string for response
         )
     except Exception as e:
-        print(f"Error during agent query: {e}")
+        logger.error("Error during agent query: %s", e)
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=f"Failed to process agent query: {e}"
         )
 
+@app.post("/agent-query/stream", summary="Ask a Complex Query using Gemini Agent with Tools, streaming the answer")
+async def agent_query_stream(
+    request: AgentQueryRequest,
+    user_id: str = Depends(get_current_user_id),
+    supabase_service: SupabaseService = Depends(get_supabase_service),
+    gemini_agent_service: GeminiAgentService = Depends(get_gemini_agent_service)
+):
+    """
+    Same as /agent-query, but streams Server-Sent Events: {"tool_call": ...} as the agent
+    uses tools, {"delta": text} as the final answer is generated, then {"done": true}.
+    """
+    async def events():
+        answer_parts = []
+        try:
+            async for event in gemini_agent_service.stream_agent(request.document_id, request.query):
+                if "delta" in event:
+                    answer_parts.append(event["delta"])
+                yield _sse(event)
+        except Exception as e:
+            logger.exception("Error during streamed agent query: %s", e)
+            yield _sse({"error": f"Failed to process agent query: {e}"})
+            return
+        yield _sse({"done": True})
+        try:
+            await supabase_service.save_conversation(user_id, request.document_id, request.query, "".join(answer_parts))
+        except Exception as e:
+            logger.error("Error saving streamed conversation: %s", e)
+
+    return StreamingResponse(events(), media_type="text/event-stream")
+
 @app.get("/check-gemini", summary="Check Gemini API Status")
-async def check_gemini_status():
+async def check_gemini_status(
+    gemini_service: GeminiService = Depends(get_gemini_service)
+):
     """
     Checks if the Gemini API is accessible and functional by making a small test call.
     """
@@ -256,12 +492,13 @@ async def check_gemini_status():
             generation_config={"max_output_tokens": 5} # Keep it very short
         )
         # Check if a response was received and has content
-        if response and response.candidates and response.candidates[0].content.parts[0].text:
-            return {"status": "ok", "message": "Gemini API is working correctly.", "test_response": response.candidates[0].content.parts[0].text.strip()}
+        test_response = response.text.strip() if response and response.candidates else ""
+        if test_response:
+            return {"status": "ok", "message": "Gemini API is working correctly.", "test_response": test_response}
         else:
             raise Exception("Gemini API returned an empty or unexpected response.")
     except Exception as e:
-        print(f"Gemini API check failed: {e}")
+        logger.error("Gemini API check failed: %s", e)
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=f"Gemini API check failed: {e}. Please check your API key and network connection."
@@ -269,17 +506,20 @@ async def check_gemini_status():
     
 @app.get("/documents", response_model=List[DocumentListItem], summary="List User's Documents")
 async def list_user_documents(
-    user_id: str = Depends(get_current_user_id)
+    limit: int | None = Query(None, ge=1, le=200, description="Maximum number of documents to return. Omit to return all."),
+    offset: int = Query(0, ge=0, description="Number of documents to skip."),
+    user_id: str = Depends(get_current_user_id),
+    supabase_service: SupabaseService = Depends(get_supabase_service)
 ):
     """
-    Retrieves a list of all documents uploaded by the current user,
-    including their ID and filename (title).
+    Retrieves the documents uploaded by the current user, newest first,
+    including their ID and filename (title). Pass `limit` (and `offset`) to page.
     """
     try:
-        documents = await supabase_service.get_user_documents(user_id)
+        documents = await supabase_service.get_user_documents(user_id, limit=limit, offset=offset)
         return [DocumentListItem(id=doc['id'], filename=doc['filename']) for doc in documents]
     except Exception as e:
-        print(f"Error listing documents for user {user_id}: {e}")
+        logger.error("Error listing documents for user %s: %s", user_id, e)
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=f"Failed to retrieve documents: {e}"
@@ -287,53 +527,72 @@ async def list_user_documents(
     
 from fastapi import Path
 
+@app.get("/documents/{document_id}/status", response_model=DocumentStatusResponse, summary="Get document indexing status")
+async def get_document_status(
+    document_id: str = Path(..., description="Document UUID"),
+    user_id: str = Depends(get_current_user_id),
+    supabase_service: SupabaseService = Depends(get_supabase_service),
+):
+    """
+    Reports whether a document's chunks have been indexed yet. Returns "indexing"
+    while /upload-pdf is still embedding in the background, "ready" once every chunk
+    is stored and the document can be used for Q&A and semantic search, and "failed"
+    if indexing stopped with an error.
+    """
+    try:
+        index_status = await supabase_service.get_index_status(document_id)
+    except Exception as e:
+        logger.error("Error checking status of document %s: %s", document_id, e)
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Failed to check document status: {e}"
+        )
+
+    if index_status is None:
+        raise HTTPException(status_code=404, detail=f"Document {document_id} not found")
+    return DocumentStatusResponse(document_id=document_id, status=index_status)
+
 @app.get("/documents/{document_id}", summary="Get document details by ID")
 async def get_document_details(
     document_id: str = Path(..., description="Document UUID"),
     user_id: str = Depends(get_current_user_id),
+    supabase_service: SupabaseService = Depends(get_supabase_service),
 ):
     """
     Return full document details (id, filename, content/extracted_text, summary, entities).
     Includes extra logging and a fallback to assemble preview from chunks.
     """
     try:
-        print(f"[DEBUG] GET /documents/{document_id} requested by user_id={user_id}")
+        logger.debug("GET /documents/%s requested by user_id=%r", document_id, user_id)
 
         # Prefer a helper if present
         doc = None
         if hasattr(supabase_service, "get_document_by_id"):
             try:
                 doc = await supabase_service.get_document_by_id(document_id)
-                print(f"[DEBUG] supabase_service.get_document_by_id returned: {type(doc)} {str(doc)[:500]}")
+                # Only the type and columns; the row holds the full document text
+                logger.debug("get_document_by_id returned %s with keys %r", type(doc).__name__, list(doc) if doc else None)
             except Exception as e:
-                print(f"[ERROR] supabase_service.get_document_by_id raised: {e}")
+                logger.error("get_document_by_id raised: %s", e)
 
         # Fallback: query raw if helper not available or returned None
         if not doc:
             try:
-                res = supabase_service.client.table("documents").select("*").eq("id", document_id).single().execute()
-                print(f"[DEBUG] raw supabase query result type: {type(res)}")
-                # log repr of result cautiously (trim long output)
-                print(f"[DEBUG] raw supabase query content (truncated): {str(res)[:1000]}")
-                # Try common shapes
-                if isinstance(res, dict) and res.get("data"):
-                    doc = res["data"]
-                else:
-                    try:
-                        data, _ = res
-                        if isinstance(data, dict):
-                            doc = data
-                        elif isinstance(data, list) and len(data) > 0:
-                            doc = data[0]
-                    except Exception:
-                        if hasattr(res, "data"):
-                            doc = res.data
+                # Only the columns this endpoint returns; maybe_single() returns None when no row matches
+                res = supabase_service.client.table("documents")\
+                    .select("id, filename, summary, entities, content")\
+                    .eq("id", document_id)\
+                    .limit(1)\
+                    .maybe_single()\
+                    .execute()
+                doc = res.data if res else None
+                logger.debug("Raw supabase query found document: %r", doc is not None)
             except Exception as e:
-                print(f"[ERROR] raw supabase query raised: {e}")
+                logger.error("Raw supabase query raised: %s", e)
 
         if not doc:
             # Not found — return 404 with helpful debug note
-            print(f"[DEBUG] Document {document_id} not found in database.")
+            logger.debug("Document %s not found in database.", document_id)
             raise HTTPException(status_code=404, detail=f"Document {document_id} not found")
 
         # If we have a row, try to get the content field or assemble from chunks
@@ -344,26 +603,21 @@ async def get_document_details(
                 chunks = []
                 if hasattr(supabase_service, "get_document_chunks"):
                     chunks = await supabase_service.get_document_chunks(document_id, top_k=10)
-                    print(f"[DEBUG] fetched {len(chunks)} chunks via helper")
+                    logger.debug("Fetched %d chunks via helper", len(chunks))
                 else:
                     # raw fallback
-                    res_chunks = supabase_service.client.table("document_chunks").select("chunk_text").eq("document_id", document_id).order("chunk_index", {"ascending": True}).limit(10).execute()
-                    print(f"[DEBUG] raw chunks query result type: {type(res_chunks)}")
-                    # parse shapes
-                    if isinstance(res_chunks, dict) and res_chunks.get("data"):
-                        chunks = res_chunks["data"]
-                    else:
-                        try:
-                            data, _ = res_chunks
-                            chunks = data
-                        except Exception:
-                            if hasattr(res_chunks, "data"):
-                                chunks = res_chunks.data
+                    res_chunks = supabase_service.client.table("document_chunks")\
+                        .select("chunk_text")\
+                        .eq("document_id", document_id)\
+                        .order("chunk_index")\
+                        .limit(10)\
+                        .execute()
+                    chunks = res_chunks.data or []
                 if chunks:
                     preview = "\n\n".join([c.get("chunk_text") or c.get("text") or "" for c in chunks])
                     content_field = preview[:20000]
             except Exception as e:
-                print(f"[ERROR] failed to assemble preview from chunks: {e}")
+                logger.error("Failed to assemble preview from chunks: %s", e)
 
         # Normalize and return
         return {
@@ -377,5 +631,5 @@ async def get_document_details(
     except HTTPException:
         raise
     except Exception as e:
-        print(f"[ERROR] Unexpected error in get_document_details: {e}")
+        logger.exception("Unexpected error in get_document_details: %s", e)
         raise HTTPException(status_code=500, detail=f"Failed to fetch document details: {e}")
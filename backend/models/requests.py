@@ -1,5 +1,5 @@
 from pydantic import BaseModel
-from typing import List, Optional
+from typing import List, Literal, Optional
 
 class QuestionRequest(BaseModel):
     document_id: str
@@ -33,4 +33,8 @@ class AgentQueryResponse(BaseModel):
 
 class DocumentListItem(BaseModel):
     id: str
-    filename: str
\ No newline at end of file
+    filename: str
+
+class DocumentStatusResponse(BaseModel):
+    document_id: str
+    status: Literal["indexing", "ready", "failed"]
\ No newline at end of file
@@ -0,0 +1,151 @@
+import asyncio
+import itertools
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Hashable
+
+import numpy as np
+
+_MISSING = object()
+
+class AsyncLRUCache:
+    """
+    In-process LRU cache for the results of async calls, with an optional TTL.
+    Concurrent misses for the same key wait for a single call instead of each
+    making their own. Failed calls are not cached.
+    With `weigh` and `max_weight`, the least recently used entries are also evicted
+    while the total weight (e.g. bytes) of the entries exceeds `max_weight`.
+    """
+    def __init__(self, maxsize: int = 1024, ttl: float | None = None,
+                 max_weight: int | None = None, weigh: Callable[[Any], int] | None = None):
+        self.maxsize = maxsize
+        self.ttl = ttl # Seconds; None means entries never expire
+        self.max_weight = max_weight
+        self._weigh = weigh
+        self._entries: OrderedDict[Hashable, tuple[float | None, Any, int]] = OrderedDict()
+        self._total_weight = 0
+        self._locks: dict[Hashable, asyncio.Lock] = {}
+
+    def _pop(self, key: Hashable):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._total_weight -= entry[2]
+
+    def _get(self, key: Hashable) -> Any:
+        entry = self._entries.get(key)
+        if entry is None:
+            return _MISSING
+        expires_at, value, _ = entry
+        if expires_at is not None and expires_at <= time.monotonic():
+            self._pop(key)
+            return _MISSING
+        self._entries.move_to_end(key)
+        return value
+
+    def _set(self, key: Hashable, value: Any):
+        self._pop(key)
+        expires_at = time.monotonic() + self.ttl if self.ttl is not None else None
+        weight = self._weigh(value) if self._weigh is not None else 0
+        self._entries[key] = (expires_at, value, weight)
+        self._total_weight += weight
+        while len(self._entries) > self.maxsize or (
+            self.max_weight is not None and self._total_weight > self.max_weight and len(self._entries) > 1
+        ):
+            self._pop(next(iter(self._entries)))
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        """Returns the cached value for key, or default if there is none."""
+        value = self._get(key)
+        return default if value is _MISSING else value
+
+    async def get_or_set(self, key: Hashable, factory: Callable[[], Awaitable[Any]]) -> Any:
+        """Returns the cached value for key, calling factory() to compute it on a miss."""
+        value = self._get(key)
+        if value is not _MISSING:
+            return value
+
+        lock = self._locks.setdefault(key, asyncio.Lock())
+        try:
+            async with lock:
+                # Another caller may have filled the entry while we waited for the lock
+                value = self._get(key)
+                if value is _MISSING:
+                    value = await factory()
+                    self._set(key, value)
+                return value
+        finally:
+            if not lock.locked():
+                self._locks.pop(key, None)
+
+    def invalidate(self, key: Hashable):
+        """Drops the cached value for key, if any."""
+        self._pop(key)
+
+class SemanticCache:
+    """
+    Caches responses by the embedding of the query that produced them, so a new
+    query that means the same thing can reuse the response. Entries are grouped by
+    namespace (e.g. a document ID) and only match within their namespace.
+    A lookup hits when the cosine similarity to a stored query is at least
+    `threshold`. The least recently used entries are evicted beyond `maxsize`,
+    and entries expire `ttl` seconds after they are stored.
+    """
+    def __init__(self, maxsize: int = 1000, threshold: float = 0.95, ttl: float | None = None):
+        self.maxsize = maxsize
+        self.threshold = threshold
+        self.ttl = ttl # Seconds; None means entries never expire
+        # entry id -> (namespace, response, expiry time or None)
+        self._entries: OrderedDict[int, tuple[Hashable, Any, float | None]] = OrderedDict()
+        # Per namespace: a matrix of L2-normalized query embeddings, one row per entry id
+        self._matrices: dict[Hashable, np.ndarray] = {}
+        self._entry_ids: dict[Hashable, list[int]] = {}
+        self._next_id = itertools.count()
+
+    @staticmethod
+    def _normalize(embedding: list[float]) -> np.ndarray:
+        vector = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def lookup(self, namespace: Hashable, embedding: list[float]) -> Any | None:
+        """Returns the response cached for the most similar query, or None if none is similar enough."""
+        matrix = self._matrices.get(namespace)
+        if matrix is None:
+            return None
+        # One matrix-vector product scores the query against every cached query at once
+        similarities = matrix @ self._normalize(embedding)
+        best = int(np.argmax(similarities))
+        if similarities[best] < self.threshold:
+            return None
+        entry_id = self._entry_ids[namespace][best]
+        _, response, expires_at = self._entries[entry_id]
+        if expires_at is not None and expires_at <= time.monotonic():
+            self._remove(entry_id)
+            return None
+        self._entries.move_to_end(entry_id)
+        return response
+
+    def store(self, namespace: Hashable, embedding: list[float], response: Any):
+        """Caches a response under the embedding of the query that produced it."""
+        entry_id = next(self._next_id)
+        expires_at = time.monotonic() + self.ttl if self.ttl is not None else None
+        self._entries[entry_id] = (namespace, response, expires_at)
+        self._entry_ids.setdefault(namespace, []).append(entry_id)
+        row = self._normalize(embedding)[np.newaxis, :]
+        matrix = self._matrices.get(namespace)
+        self._matrices[namespace] = row if matrix is None else np.vstack([matrix, row])
+
+        while len(self._entries) > self.maxsize:
+            self._remove(next(iter(self._entries)))
+
+    def _remove(self, entry_id: int):
+        """Drops an entry and its row from its namespace's matrix."""
+        namespace, _, _ = self._entries.pop(entry_id)
+        entry_ids = self._entry_ids[namespace]
+        index = entry_ids.index(entry_id)
+        del entry_ids[index]
+        if entry_ids:
+            self._matrices[namespace] = np.delete(self._matrices[namespace], index, axis=0)
+        else:
+            del self._entry_ids[namespace]
+            del self._matrices[namespace]
@@ -0,0 +1,71 @@
+import os
+import orjson
+import struct
+import asyncio
+import asyncpg
+import numpy as np
+from dotenv import load_dotenv
+
+load_dotenv()
+
+_pool: asyncpg.Pool | None = None
+_pool_lock = asyncio.Lock()
+
+def _encode_halfvec(value) -> bytes:
+    """Encodes a sequence of floats in pgvector's binary halfvec format: dim, unused, then big-endian FP16 values."""
+    vector = np.asarray(value, dtype=">f2")
+    return struct.pack(">HH", len(vector), 0) + vector.tobytes()
+
+def _decode_halfvec(data: bytes) -> np.ndarray:
+    """Decodes pgvector's binary halfvec format into a float16 numpy array."""
+    dim, _ = struct.unpack_from(">HH", data)
+    return np.frombuffer(data, dtype=">f2", count=dim, offset=4).astype(np.float16)
+
+async def _init_connection(conn: asyncpg.Connection):
+    """
+    Decodes jsonb columns to Python objects, matching what PostgREST returns, and sends
+    halfvec values in binary (2 bytes per dimension instead of their text form).
+    """
+    await conn.set_type_codec(
+        "jsonb", encoder=lambda value: orjson.dumps(value).decode(), decoder=orjson.loads, schema="pg_catalog"
+    )
+    # pgvector may live in 'public' or Supabase's 'extensions' schema
+    halfvec_schema = await conn.fetchval(
+        "SELECT typnamespace::regnamespace::text FROM pg_type WHERE typname = 'halfvec'"
+    )
+    if halfvec_schema:
+        await conn.set_type_codec(
+            "halfvec", schema=halfvec_schema,
+            encoder=_encode_halfvec, decoder=_decode_halfvec, format="binary"
+        )
+
+async def get_pool() -> asyncpg.Pool | None:
+    """
+    Returns the shared asyncpg pool for direct Postgres access, creating it on first use.
+    Returns None if SUPABASE_DB_URL is not set, so callers can fall back to PostgREST.
+    """
+    global _pool
+    if _pool is not None:
+        return _pool
+    dsn = os.environ.get("SUPABASE_DB_URL")
+    if not dsn:
+        return None
+    async with _pool_lock:
+        if _pool is None:
+            _pool = await asyncpg.create_pool(
+                dsn=dsn,
+                min_size=10,
+                max_size=50,
+                max_inactive_connection_lifetime=300,
+                # Supabase's pooler (Supavisor/pgbouncer) doesn't support prepared statement caching
+                statement_cache_size=0,
+                init=_init_connection
+            )
+    return _pool
+
+async def close_pool():
+    """Closes the shared pool, if it was created."""
+    global _pool
+    if _pool is not None:
+        await _pool.close()
+        _pool = None
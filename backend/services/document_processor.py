@@ -1,24 +1,26 @@
-
-import io
+import logging
+from typing import BinaryIO
 from pypdf import PdfReader
-import re
+import ahocorasick # For locating many entity strings in a single pass
 import tiktoken # For better chunking based on tokens
 
+logger = logging.getLogger(__name__)
+
+# Load the tiktoken encoding once per process for token-based chunking
+try:
+    _TOKENIZER = tiktoken.get_encoding("cl100k_base")
+except Exception:
+    _TOKENIZER = None # Fallback if tiktoken fails
+
 class DocumentProcessor:
     def __init__(self):
-        # Initialize tiktoken for token-based chunking
-        try:
-            self.tokenizer = tiktoken.encoding_for_model("gpt-3.5-turbo")
-        except Exception:
-            self.tokenizer = None # Fallback if tiktoken fails
+        self.tokenizer = _TOKENIZER
 
-    def extract_text_from_pdf(self, pdf_content: bytes) -> str:
-        """Extracts text from a PDF file."""
-        reader = PdfReader(io.BytesIO(pdf_content))
-        text = ""
-        for page in reader.pages:
-            text += page.extract_text() + "\n"
-        return text
+    def extract_text_from_pdf(self, pdf_file: BinaryIO) -> str:
+        """Extracts text from a PDF file, read from any seekable binary stream."""
+        reader = PdfReader(pdf_file)
+        # Join once instead of growing a string page by page
+        return "".join((page.extract_text() or "") + "\n" for page in reader.pages)
 
     def chunk_text(self, text: str, max_tokens: int = 500, overlap_tokens: int = 50) -> list[str]:
         """
@@ -30,7 +32,7 @@ class DocumentProcessor:
 
         if not self.tokenizer:
             # Fallback to word-based chunking if tokenizer is not available
-            print("Warning: tiktoken not available, falling back to word-based chunking.")
+            logger.warning("tiktoken not available, falling back to word-based chunking.")
             words = text.split()
             chunks = []
             current_chunk_words = []
@@ -43,23 +45,51 @@ class DocumentProcessor:
                 chunks.append(" ".join(current_chunk_words))
             return chunks
 
-        tokens = self.tokenizer.encode(text)
-        chunks = []
-        current_chunk_tokens = []
+        tokens = self.tokenizer.encode_ordinary(text)
+        # Each chunk starts overlap_tokens before the end of the previous one.
+        # Stop before a start that would only repeat the previous chunk's overlap.
+        stride = max(max_tokens - overlap_tokens, 1)
+        chunks_tokens = [
+            tokens[i:i + max_tokens]
+            for i in range(0, max(len(tokens) - overlap_tokens, 1), stride)
+        ]
+        return self.tokenizer.decode_batch(chunks_tokens)
 
-        for token in tokens:
-            current_chunk_tokens.append(token)
-            if len(current_chunk_tokens) >= max_tokens:
-                chunks.append(self.tokenizer.decode(current_chunk_tokens))
-                # Start new chunk with overlap
-                current_chunk_tokens = current_chunk_tokens[-overlap_tokens:]
+    def clean_text(self, text: str) -> str:
+        """Basic text cleaning (remove extra whitespace, newlines)."""
+        # str.split() with no arguments splits on runs of whitespace in C, without regex overhead
+        return " ".join(text.split())
 
-        if current_chunk_tokens:
-            chunks.append(self.tokenizer.decode(current_chunk_tokens))
+    def locate_entities(self, text: str, entities: list[dict]) -> list[dict]:
+        """
+        Adds start/end positions of the first occurrence of each entity in the text.
+        All entities are matched in a single Aho-Corasick pass over the text.
+        Entities missing a 'text' or 'label' are dropped; entities not found are
+        returned without positions.
+        """
+        entities = [ent for ent in entities if ent.get("text") and ent.get("label")]
+        if not entities:
+            return []
 
-        return chunks
+        automaton = ahocorasick.Automaton()
+        for ent in entities:
+            automaton.add_word(ent["text"], ent["text"])
+        automaton.make_automaton()
 
-    def clean_text(self, text: str) -> str:
-        """Basic text cleaning (remove extra whitespace, newlines)."""
-        text = re.sub(r'\s+', ' ', text).strip()
-        return text
\ No newline at end of file
+        # Matches are reported in order of end position, so the first match seen
+        # for a given string is also its first occurrence.
+        first_start: dict[str, int] = {}
+        for end_idx, found in automaton.iter(text):
+            if found not in first_start:
+                first_start[found] = end_idx - len(found) + 1
+                if len(first_start) == len(automaton):
+                    break
+
+        located = []
+        for ent in entities:
+            start_idx = first_start.get(ent["text"])
+            if start_idx is not None:
+                located.append({"text": ent["text"], "label": ent["label"], "start": start_idx, "end": start_idx + len(ent["text"])})
+            else:
+                located.append({"text": ent["text"], "label": ent["label"]})
+        return located
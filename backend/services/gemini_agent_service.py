@@ -1,28 +1,75 @@
 import os
-import json
+import logging
+import orjson
+import functools
 import asyncio
 import google.generativeai as genai
 from dotenv import load_dotenv
-from typing import List, Dict, Any, Callable
+from typing import List, Dict, Any, Callable, AsyncIterator
 
 # Import services that the agent's tools will interact with
-from services.supabase_service import SupabaseService
-from services.gemini_service import GeminiService # For embeddings if needed by tools
+from services.supabase_service import SupabaseService, get_supabase_service
+from services.gemini_service import GeminiService, get_gemini_service # For embeddings if needed by tools
+from services.cache import AsyncLRUCache, SemanticCache
 
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
+# Tool schemas for Gemini function calling, built once at import
+_TOOL_SCHEMAS = (
+    genai.protos.FunctionDeclaration(
+        name="get_document_summary",
+        description="Retrieves the pre-generated summary of a specific document.",
+        parameters=genai.protos.Schema(
+            type=genai.protos.Type.OBJECT,
+            properties={
+                "document_id": genai.protos.Schema(type=genai.protos.Type.STRING, description="The unique ID of the document.")
+            },
+            required=["document_id"]
+        )
+    ),
+    genai.protos.FunctionDeclaration(
+        name="get_document_entities",
+        description="Retrieves the pre-generated named entities (PERSON, ORG, LOC, DATE, MONEY, GPE) from a specific document.",
+        parameters=genai.protos.Schema(
+            type=genai.protos.Type.OBJECT,
+            properties={
+                "document_id": genai.protos.Schema(type=genai.protos.Type.STRING, description="The unique ID of the document.")
+            },
+            required=["document_id"]
+        )
+    ),
+    genai.protos.FunctionDeclaration(
+        name="semantic_search_document",
+        description="Performs a semantic search within a document to find relevant text sections based on a query.",
+        parameters=genai.protos.Schema(
+            type=genai.protos.Type.OBJECT,
+            properties={
+                "document_id": genai.protos.Schema(type=genai.protos.Type.STRING, description="The unique ID of the document."),
+                "query": genai.protos.Schema(type=genai.protos.Type.STRING, description="The search query or question to find relevant sections.")
+            },
+            required=["document_id", "query"]
+        )
+    ),
+)
+
 class GeminiAgentService:
+    # Maximum model turns per query; caps worst-case latency and token spend if Gemini keeps calling tools
+    MAX_AGENT_STEPS = int(os.environ.get("AGENT_MAX_STEPS", 6))
+
     def __init__(self, supabase_service: SupabaseService, gemini_service: GeminiService):
-        self.api_key = os.environ.get("GEMINI_API_KEY")
-        if not self.api_key:
-            raise ValueError("GEMINI_API_KEY environment variable not set.")
-        genai.configure(api_key=self.api_key)
-        
-        # Use a model that supports function calling
-        self.model = genai.GenerativeModel('gemini-2.0-flash') # gemini-pro supports function calling
+        # genai is already configured with the API key by GeminiService
+        # Use a model that supports function calling, with the document tools attached
+        self.model = genai.GenerativeModel('gemini-2.0-flash', tools=_TOOL_SCHEMAS)
         
         self.supabase_service = supabase_service
         self.gemini_service = gemini_service
+
+        # Semantic search results per document, reused for queries with near-identical meaning
+        self._search_cache = SemanticCache(maxsize=1000, threshold=0.95, ttl=10 * 60)
+        # Document rows, shared by the summary and entities tools so one turn calling both makes one query
+        self._doc_cache = AsyncLRUCache(maxsize=256, ttl=60)
         
         # Define the tools the agent can use
         self.tools: Dict[str, Callable] = {
@@ -32,60 +79,24 @@ class GeminiAgentService:
             # Add other general tools if needed, e.g., calculator, wikipedia, etc.
             # For DocuMate AI, we focus on document-specific tools.
         }
-        
-        # Register tools with the Gemini model
-        self._register_tools_with_model()
-
-    def _register_tools_with_model(self):
-        """Registers the Python functions as tools for the Gemini model."""
-        # Define the tool schemas for Gemini
-        tool_schemas = [
-            genai.protos.FunctionDeclaration(
-                name="get_document_summary",
-                description="Retrieves the pre-generated summary of a specific document.",
-                parameters=genai.protos.Schema(
-                    type=genai.protos.Type.OBJECT,
-                    properties={
-                        "document_id": genai.protos.Schema(type=genai.protos.Type.STRING, description="The unique ID of the document.")
-                    },
-                    required=["document_id"]
-                )
-            ),
-            genai.protos.FunctionDeclaration(
-                name="get_document_entities",
-                description="Retrieves the pre-generated named entities (PERSON, ORG, LOC, DATE, MONEY, GPE) from a specific document.",
-                parameters=genai.protos.Schema(
-                    type=genai.protos.Type.OBJECT,
-                    properties={
-                        "document_id": genai.protos.Schema(type=genai.protos.Type.STRING, description="The unique ID of the document.")
-                    },
-                    required=["document_id"]
-                )
-            ),
-            genai.protos.FunctionDeclaration(
-                name="semantic_search_document",
-                description="Performs a semantic search within a document to find relevant text sections based on a query.",
-                parameters=genai.protos.Schema(
-                    type=genai.protos.Type.OBJECT,
-                    properties={
-                        "document_id": genai.protos.Schema(type=genai.protos.Type.STRING, description="The unique ID of the document."),
-                        "query": genai.protos.Schema(type=genai.protos.Type.STRING, description="The search query or question to find relevant sections.")
-                    },
-                    required=["document_id", "query"]
-                )
-            ),
-        ]
-        
-        # Configure the model to use these tools
-        self.model = genai.GenerativeModel('gemini-pro', tools=tool_schemas)
+
+    async def _get_doc(self, document_id: str) -> Dict[str, Any]:
+        """
+        Returns the document row (summary, entities, content) from Supabase, cached for 60 seconds.
+        Concurrent calls for the same document share a single fetch.
+        """
+        document = await self._doc_cache.get_or_set(
+            document_id, lambda: self.supabase_service.get_document_by_id(document_id)
+        )
+        return document or {}
 
     # --- Tool Implementations (wrappers around existing services) ---
     async def _get_document_summary_tool(self, document_id: str) -> str:
         """Retrieves the summary of a document from Supabase."""
         try:
-            data, count = await self.supabase_service.client.table('documents').select('summary').eq('id', document_id).single().execute()
-            if data and data[1] and data[1]['summary']:
-                return data[1]['summary']
+            summary = (await self._get_doc(document_id)).get('summary')
+            if summary:
+                return summary
             return f"No summary found for document ID: {document_id}"
         except Exception as e:
             return f"Error retrieving summary for document ID {document_id}: {e}"
@@ -93,10 +104,10 @@ class GeminiAgentService:
     async def _get_document_entities_tool(self, document_id: str) -> str:
         """Retrieves the entities of a document from Supabase."""
         try:
-            data, count = await self.supabase_service.client.table('documents').select('entities').eq('id', document_id).single().execute()
-            if data and data[1] and data[1]['entities']:
+            entities = (await self._get_doc(document_id)).get('entities')
+            if entities:
                 # Return as a JSON string for Gemini to parse
-                return json.dumps(data[1]['entities'])
+                return orjson.dumps(entities).decode()
             return f"No entities found for document ID: {document_id}"
         except Exception as e:
             return f"Error retrieving entities for document ID {document_id}: {e}"
@@ -104,15 +115,77 @@ class GeminiAgentService:
     async def _semantic_search_document_tool(self, document_id: str, query: str) -> str:
         """Performs semantic search on document chunks and returns relevant text."""
         try:
-            query_embedding = await self.gemini_service.get_embedding(query)
-            relevant_chunks = await self.supabase_service.get_relevant_chunks(document_id, query_embedding, top_k=5)
-            if relevant_chunks:
-                return "Relevant sections:\n" + "\n---\n".join(relevant_chunks)
+            # Exact repeats are served from the embedding cache; similar queries from the search cache
+            query_embedding = await self.gemini_service.get_embedding(query, task_type="RETRIEVAL_QUERY")
+            cached_result = self._search_cache.lookup(document_id, query_embedding)
+            if cached_result is not None:
+                return cached_result
+            # Searching a partial index would look like a genuine miss, so say why there are no results
+            index_status = await self.supabase_service.get_index_status(document_id)
+            if index_status == "indexing":
+                return f"Document ID {document_id} is still being indexed; semantic search is not available yet."
+            if index_status != "ready":
+                return f"Document ID {document_id} has no searchable index (status: {index_status})."
+            # The chunks come back already joined (string_agg in Postgres when the pool is available)
+            relevant_context = await self.supabase_service.get_relevant_context(
+                document_id, query_embedding, top_k=5, separator="\n---\n"
+            )
+            if relevant_context:
+                result = "Relevant sections:\n" + relevant_context
+                # The document is fully indexed, so the result is safe to reuse
+                self._search_cache.store(document_id, query_embedding, result)
+                return result
             return f"No relevant sections found for query '{query}' in document ID: {document_id}"
         except Exception as e:
             return f"Error performing semantic search for document ID {document_id}: {e}"
 
     # --- Agent Execution Logic ---
+    async def _run_tool(self, tool_name: str, tool_args: Dict[str, Any]) -> str:
+        """Executes one tool call. Errors are returned as text so Gemini can see and react to them."""
+        if tool_name not in self.tools:
+            error_message = f"Agent tried to call unknown tool: {tool_name}"
+            logger.error(error_message)
+            return error_message
+        try:
+            tool_output = await self.tools[tool_name](**tool_args)
+            logger.debug("Tool '%s' output: %s...", tool_name, tool_output[:100]) # Log first 100 chars
+            return tool_output
+        except Exception as e:
+            error_message = f"Error executing tool '{tool_name}': {e}"
+            logger.error(error_message)
+            return error_message
+
+    async def _run_function_calls(self, document_id: str, function_calls: list,
+                                  tool_calls_history: List[Dict[str, Any]]) -> List[Any]:
+        """
+        Executes the tool calls Gemini requested in one turn, concurrently, and returns
+        the function-response parts to send back. Each call is appended to tool_calls_history.
+        """
+        calls = []
+        for tool_call in function_calls:
+            tool_args = {k: v for k, v in tool_call.args.items()} # Convert protobuf map to dict
+            # Pass document_id to tools that need it
+            if 'document_id' in tool_args:
+                tool_args['document_id'] = document_id # Ensure document_id is passed
+
+            logger.debug("Agent decided to call tool: %s with args: %s", tool_call.name, tool_args)
+            tool_calls_history.append({"tool": tool_call.name, "args": tool_args})
+            calls.append((tool_call.name, tool_args))
+
+        # Execute independent tool calls concurrently
+        tool_outputs = await asyncio.gather(*[self._run_tool(name, args) for name, args in calls])
+        return [
+            genai.protos.Part(
+                function_response=genai.protos.FunctionResponse(
+                    name=tool_name,
+                    response={
+                        "content": tool_output
+                    }
+                )
+            )
+            for (tool_name, _), tool_output in zip(calls, tool_outputs)
+        ]
+
     async def invoke_agent(self, document_id: str, user_query: str) -> Dict[str, Any]:
         """
         Invokes the Gemini agent to process a user query, potentially using tools.
@@ -123,63 +196,33 @@ class GeminiAgentService:
         response = await chat.send_message_async(user_query)
         
         tool_calls_history = []
+        iterations = 0
 
-        # Loop to handle tool calls
+        # Loop to handle tool calls. Each pass handles one model turn.
         while True:
+            iterations += 1
             if response.candidates and response.candidates[0].content.parts:
-                part = response.candidates[0].content.parts[0]
-                
-                # Check if Gemini wants to call a tool
-                if part.function_call:
-                    tool_call = part.function_call
-                    tool_name = tool_call.name
-                    tool_args = {k: v for k, v in tool_call.args.items()} # Convert protobuf map to dict
-
-                    print(f"Agent decided to call tool: {tool_name} with args: {tool_args}")
-                    tool_calls_history.append({"tool": tool_name, "args": tool_args})
-
-                    if tool_name in self.tools:
-                        try:
-                            # Pass document_id to tools that need it
-                            if 'document_id' in tool_args:
-                                tool_args['document_id'] = document_id # Ensure document_id is passed
-                            
-                            # Execute the tool
-                            tool_output = await self.tools[tool_name](**tool_args)
-                            print(f"Tool '{tool_name}' output: {tool_output[:100]}...") # Print first 100 chars
-                            
-                            # Send tool output back to Gemini
-                            response = await chat.send_message_async(
-                                genai.protos.Part(
-                                    function_response=genai.protos.FunctionResponse(
-                                        name=tool_name,
-                                        response={
-                                            "content": tool_output
-                                        }
-                                    )
-                                )
-                            )
-                        except Exception as e:
-                            error_message = f"Error executing tool '{tool_name}': {e}"
-                            print(error_message)
-                            response = await chat.send_message_async(
-                                genai.protos.Part(
-                                    function_response=genai.protos.FunctionResponse(
-                                        name=tool_name,
-                                        response={
-                                            "content": error_message
-                                        }
-                                    )
-                                )
-                            )
-                    else:
-                        error_message = f"Agent tried to call unknown tool: {tool_name}"
-                        print(error_message)
-                        response = await chat.send_message_async(error_message) # Send error back to Gemini
+                parts = response.candidates[0].content.parts
+                function_calls = [part.function_call for part in parts if part.function_call]
+
+                # Check if Gemini wants to call tools. A single turn may request several.
+                if function_calls:
+                    # Prevent infinite loops in case Gemini gets stuck: stop before paying
+                    # for the tools and another model turn
+                    if iterations >= self.MAX_AGENT_STEPS:
+                        logger.warning("Agent loop exceeded maximum iterations.")
+                        return {
+                            "answer": "I'm having trouble processing this request. The conversation became too long.",
+                            "tool_calls": tool_calls_history,
+                            "final_prompt": chat.history
+                        }
+                    # Send all tool outputs back to Gemini in a single message
+                    tool_responses = await self._run_function_calls(document_id, function_calls, tool_calls_history)
+                    response = await chat.send_message_async(tool_responses)
                 else:
                     # Gemini provided a final text response
-                    final_answer = part.text
-                    print(f"Agent final answer: {final_answer}")
+                    final_answer = parts[0].text
+                    logger.debug("Agent final answer: %s", final_answer)
                     return {
                         "answer": final_answer,
                         "tool_calls": tool_calls_history,
@@ -187,18 +230,55 @@ class GeminiAgentService:
                     }
             else:
                 # No candidates or content parts, something went wrong or model finished without text
-                print("Gemini agent finished without a clear text response or tool call.")
+                logger.warning("Gemini agent finished without a clear text response or tool call.")
                 return {
                     "answer": "I couldn't process that request fully. Please try again.",
                     "tool_calls": tool_calls_history,
                     "final_prompt": chat.history
                 }
-            
-            # Prevent infinite loops in case Gemini gets stuck
-            if len(chat.history) > 20: # Arbitrary limit for safety
-                print("Agent loop exceeded maximum iterations.")
-                return {
-                    "answer": "I'm having trouble processing this request. The conversation became too long.",
-                    "tool_calls": tool_calls_history,
-                    "final_prompt": chat.history
-                }
\ No newline at end of file
+
+    async def stream_agent(self, document_id: str, user_query: str) -> AsyncIterator[Dict[str, Any]]:
+        """
+        Streaming variant of invoke_agent. Yields {"tool_call": ...} events as tools are
+        called and {"delta": text} events as the final answer is generated, so the
+        client sees the first tokens without waiting for the full answer.
+        """
+        chat = self.model.start_chat(history=[])
+        message = user_query
+        tool_calls_history = []
+        iterations = 0
+
+        while True:
+            iterations += 1
+            response = await chat.send_message_async(message, stream=True)
+
+            # Text is forwarded as soon as it arrives; tool calls are collected until the turn ends
+            function_calls = []
+            async for chunk in response:
+                if not chunk.candidates:
+                    continue
+                for part in chunk.candidates[0].content.parts:
+                    if part.function_call:
+                        function_calls.append(part.function_call)
+                    elif part.text:
+                        yield {"delta": part.text}
+
+            if not function_calls:
+                return
+
+            # Prevent infinite loops in case Gemini gets stuck: stop before paying
+            # for the tools and another model turn (same accounting as invoke_agent)
+            if iterations >= self.MAX_AGENT_STEPS:
+                logger.warning("Agent loop exceeded maximum iterations.")
+                yield {"delta": "I'm having trouble processing this request. The conversation became too long."}
+                return
+
+            called_before = len(tool_calls_history)
+            message = await self._run_function_calls(document_id, function_calls, tool_calls_history)
+            for tool_call in tool_calls_history[called_before:]:
+                yield {"tool_call": tool_call}
+
+@functools.lru_cache(maxsize=1)
+def get_gemini_agent_service() -> GeminiAgentService:
+    """Returns the process-wide GeminiAgentService, built on the shared Supabase and Gemini services."""
+    return GeminiAgentService(get_supabase_service(), get_gemini_service())
@@ -1,10 +1,132 @@
 import os
+import logging
+import asyncio
+import hashlib
+import datetime
+import functools
+import orjson
+import numpy as np
+from typing import AsyncIterator
 import google.generativeai as genai
+from google.api_core import exceptions as google_exceptions
+from google.api_core import retry as google_retry
+from google.api_core import retry_async
 from dotenv import load_dotenv
 import tiktoken # For token counting
 
+try:
+    import spacy # For local named-entity recognition
+except ImportError:
+    spacy = None
+
+try:
+    from sentence_transformers import SentenceTransformer # For optional local embeddings
+except ImportError:
+    SentenceTransformer = None
+
+from services.cache import AsyncLRUCache
+
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
+# The embedding API accepts at most this many texts per batch request
+EMBEDDING_BATCH_SIZE = 100
+# Maximum number of in-flight single-text embedding calls, to stay under Gemini's QPS limits
+EMBEDDING_CONCURRENCY = 16
+# Gemini outputs for a given model and input are stable, so cached results can live for hours
+CACHE_TTL_SECONDS = 6 * 60 * 60
+# Returned by generate_answer when Gemini fails; never worth caching
+ANSWER_UNAVAILABLE = "I apologize, but I couldn't generate an answer at this time."
+# Local NER: the spaCy model to load, the entity labels we keep, and the text size
+# handed to spaCy at a time (well under its default 1M-character limit)
+SPACY_MODEL = "en_core_web_sm"
+ENTITY_LABELS = {"PERSON", "ORG", "LOC", "GPE", "DATE", "MONEY"}
+NER_SEGMENT_CHARS = 100_000
+# Embeddings come from Gemini by default. EMBEDDING_BACKEND=local computes them in-process
+# with an int8-quantized ONNX export of a small sentence-transformers model instead.
+# The local model outputs 384 dimensions, so document_chunks.embedding (and the
+# match_document_chunks signature) must be halfvec(384) and existing chunks re-embedded.
+EMBEDDING_BACKEND = os.environ.get("EMBEDDING_BACKEND", "gemini")
+LOCAL_EMBEDDING_MODEL = "sentence-transformers/all-MiniLM-L6-v2"
+LOCAL_EMBEDDING_ONNX_FILE = os.environ.get("LOCAL_EMBEDDING_ONNX_FILE", "onnx/model_quint8_avx2.onnx")
+
+# Gemini context caching: a document's full text is stored server-side once, and questions
+# reference it by name instead of resending it. Explicit caching needs a pinned model
+# version and has a minimum input size, so small documents keep using retrieved context.
+CONTEXT_CACHE_MODEL = "models/gemini-2.0-flash-001"
+CONTEXT_CACHE_MIN_TOKENS = 4096
+CONTEXT_CACHE_TTL = datetime.timedelta(hours=1)
+CONTEXT_CACHE_INSTRUCTION = (
+    "Answer questions using only the provided document. If the answer is not explicitly present "
+    "in the document, state that you don't know or that the information is not available. "
+    "Do not make up information."
+)
+
+# Request options for unary Gemini calls: transient failures (rate limits, unavailability,
+# timeouts) are retried with exponential backoff instead of failing the request.
+# The SDK keeps one gRPC channel per service for the whole process, so concurrent calls
+# are already multiplexed over a single kept-alive HTTP/2 connection.
+REQUEST_OPTIONS = {
+    "retry": retry_async.AsyncRetry(
+        predicate=google_retry.if_exception_type(
+            google_exceptions.ResourceExhausted,
+            google_exceptions.ServiceUnavailable,
+            google_exceptions.DeadlineExceeded,
+            google_exceptions.InternalServerError,
+        ),
+        initial=1.0,
+        maximum=10.0,
+        multiplier=2.0,
+        timeout=60.0,
+    )
+}
+
+# tiktoken for token counting (approximation for Gemini)
+# Gemini doesn't use OpenAI's tokenizers, but this gives an estimate within about 10%,
+# which is good enough for sizing prompts. For precise Gemini token counts, use
+# count_tokens(..., precise=True), which asks the model over the network.
+try:
+    _TOKENIZER = tiktoken.get_encoding("cl100k_base")
+except Exception:
+    _TOKENIZER = None # Fallback if tiktoken fails
+
+# Only texts up to this size are memoized, so whole documents aren't kept alive as cache keys
+TOKEN_COUNT_MEMO_MAX_CHARS = 8_192
+
+def _count_tokens_locally(text: str) -> int:
+    """Counts tokens locally with tiktoken."""
+    if _TOKENIZER:
+        return len(_TOKENIZER.encode_ordinary(text))
+    return len(text.split()) # Very rough estimate
+
+_memoized_token_count = functools.lru_cache(maxsize=1024)(_count_tokens_locally)
+
+def _approximate_token_count(text: str) -> int:
+    """Counts tokens locally. Short texts are memoized, so repeated prompts are free."""
+    if len(text) > TOKEN_COUNT_MEMO_MAX_CHARS:
+        return _count_tokens_locally(text)
+    return _memoized_token_count(text)
+
+def _l2_normalize(embeddings: list[list[float]]) -> list[list[float]]:
+    """
+    Scales each embedding to unit length. Stored and query embeddings are normalized,
+    so pgvector can rank by inner product (<#>) instead of cosine distance.
+    """
+    matrix = np.asarray(embeddings, dtype=np.float32)
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    return (matrix / np.where(norms == 0, 1, norms)).tolist()
+
+# The batch embedding request itself was rejected or isn't supported; single-text calls may still work.
+# Anything else (rate limits after REQUEST_OPTIONS' retries, auth) would only fail again per text
+_BATCH_UNSUPPORTED_ERRORS = (google_exceptions.InvalidArgument, google_exceptions.MethodNotImplemented)
+
+# A context cache that no longer exists (expired or deleted) is reported as one of these
+_CONTEXT_CACHE_GONE_ERRORS = (google_exceptions.NotFound, google_exceptions.PermissionDenied)
+
+class ContextCacheExpired(Exception):
+    """Raised when a Gemini context cache no longer exists, so its stored name should be forgotten."""
+
 class GeminiService:
     def __init__(self):
         self.api_key = os.environ.get("GEMINI_API_KEY")
@@ -14,39 +136,111 @@ class GeminiService:
         self.generative_model = genai.GenerativeModel('gemini-2.0-flash')
         self.embedding_model = 'models/text-embedding-004' # Or 'embedding-001' if 004 is not available/preferred
 
-        # Initialize tiktoken for token counting (approximation for Gemini)
-        # Gemini doesn't use OpenAI's tokenizers, but this can give a rough estimate
-        # For precise Gemini token counts, you'd use the model's own count_tokens method
+        # In-process caches so repeated queries and duplicate uploads skip the Gemini round-trip.
+        # Keys include the model name, so switching models never returns stale results.
+        self._embedding_cache = AsyncLRUCache(maxsize=4096, ttl=CACHE_TTL_SECONDS)
+        self._summary_cache = AsyncLRUCache(maxsize=256, ttl=CACHE_TTL_SECONDS)
+        self._entities_cache = AsyncLRUCache(maxsize=256, ttl=CACHE_TTL_SECONDS)
+        # Models bound to a context cache, by cache name (None if the cache can't be used)
+        self._cached_models = AsyncLRUCache(maxsize=256, ttl=300)
+
+        # Load spaCy once for local entity extraction; without it, entities come from Gemini
         try:
-            self.tokenizer = tiktoken.encoding_for_model("gpt-3.5-turbo")
+            self.nlp = spacy.load(SPACY_MODEL, disable=["parser", "lemmatizer"]) if spacy else None
         except Exception:
-            self.tokenizer = None # Fallback if tiktoken fails
+            self.nlp = None
 
-    def count_tokens(self, text: str) -> int:
-        """Counts tokens in a given text using Gemini's model method."""
-        try:
-            return self.generative_model.count_tokens(text).total_tokens
-        except Exception as e:
-            print(f"Warning: Could not get exact Gemini token count: {e}. Falling back to approximation.")
-            if self.tokenizer:
-                return len(self.tokenizer.encode(text))
-            return len(text.split()) # Very rough estimate
+        # Load the local embedding model once if requested. There is no fallback to Gemini:
+        # its 768-d embeddings wouldn't fit a column migrated for the local model.
+        self.local_embedder = None
+        if EMBEDDING_BACKEND == "local":
+            if SentenceTransformer is None:
+                raise ValueError("EMBEDDING_BACKEND=local requires the sentence-transformers package.")
+            try:
+                self.local_embedder = SentenceTransformer(
+                    LOCAL_EMBEDDING_MODEL, backend="onnx", model_kwargs={"file_name": LOCAL_EMBEDDING_ONNX_FILE}
+                )
+            except Exception as e:
+                raise ValueError(f"Could not load local embedding model {LOCAL_EMBEDDING_MODEL}: {e}") from e
+
+    @staticmethod
+    def _cache_key(model_name: str, text: str) -> str:
+        """Builds a cache key from the model name and a hash of the text."""
+        return f"{model_name}:{hashlib.sha1(text.encode()).hexdigest()}"
+
+    def count_tokens(self, text: str, precise: bool = False) -> int:
+        """
+        Counts tokens in a given text. By default this is a local tiktoken estimate;
+        pass precise=True to get Gemini's exact count, which costs a network round-trip.
+        """
+        if precise:
+            try:
+                return self.generative_model.count_tokens(text).total_tokens
+            except Exception as e:
+                logger.warning("Could not get exact Gemini token count: %s. Falling back to approximation.", e)
+        return _approximate_token_count(text)
 
     async def generate_summary(self, text: str) -> str:
         """Generates a concise summary of the given text."""
         prompt = f"Summarize the following document concisely, highlighting key points. Keep the summary to a maximum of 200 words:\n\n{text}"
-        try:
+
+        async def summarize() -> str:
             response = await self.generative_model.generate_content_async(
                 prompt,
-                generation_config=genai.GenerationConfig(max_output_tokens=250) # Set max output tokens
+                generation_config=genai.GenerationConfig(max_output_tokens=250), # Set max output tokens
+                request_options=REQUEST_OPTIONS
             )
-            return response.candidates[0].content.parts[0].text
+            return response.text
+
+        try:
+            return await self._summary_cache.get_or_set(self._cache_key(self.generative_model.model_name, text), summarize)
         except Exception as e:
-            print(f"Error generating summary with Gemini: {e}")
+            logger.error("Error generating summary with Gemini: %s", e)
             return "Failed to generate summary."
 
+    def _extract_entities_locally(self, text: str) -> list[dict]:
+        """
+        Extracts entities with the local spaCy pipeline. Long text is split at sentence
+        ends into segments processed as one nlp.pipe batch. Each (text, label) pair is
+        returned once, in order of first appearance.
+        """
+        segments = []
+        start = 0
+        while start < len(text):
+            end = min(start + NER_SEGMENT_CHARS, len(text))
+            if end < len(text):
+                boundary = text.rfind(". ", start, end)
+                if boundary > start:
+                    end = boundary + 1
+            segments.append(text[start:end])
+            start = end
+
+        seen = set()
+        entities = []
+        for doc in self.nlp.pipe(segments, batch_size=32):
+            for ent in doc.ents:
+                key = (ent.text, ent.label_)
+                if ent.label_ in ENTITY_LABELS and key not in seen:
+                    seen.add(key)
+                    entities.append({"text": ent.text, "label": ent.label_})
+        return entities
+
     async def extract_entities(self, text: str) -> list[dict]:
-        """Extracts entities (PERSON, ORG, LOC, DATE, MONEY) from the text."""
+        """
+        Extracts entities (PERSON, ORG, LOC, DATE, MONEY, GPE) from the text.
+        Uses the local spaCy model when available, which avoids an LLM round-trip,
+        and Gemini otherwise.
+        """
+        if self.nlp is not None:
+            try:
+                return await self._entities_cache.get_or_set(
+                    self._cache_key(f"spacy:{SPACY_MODEL}", text),
+                    lambda: asyncio.to_thread(self._extract_entities_locally, text)
+                )
+            except Exception as e:
+                logger.error("Error extracting entities with spaCy: %s", e)
+                return []
+
         prompt = f"""Extract key entities from the following text. For each entity, identify its type (PERSON, ORG, LOC, DATE, MONEY, GPE) and its exact text. Return the entities as a JSON list of objects with 'text' and 'label' keys. If no entities are found, return an empty list.
 
         Example Format:
@@ -58,22 +252,27 @@ class GeminiService:
 
         Text:\n\n{text}
         """
-        try:
+
+        async def extract() -> list[dict]:
             response = await self.generative_model.generate_content_async(
                 prompt,
-                generation_config=genai.GenerationConfig(response_mime_type="application/json") # Request JSON output
+                generation_config=genai.GenerationConfig(response_mime_type="application/json"), # Request JSON output
+                request_options=REQUEST_OPTIONS
             )
             # Gemini might return a string that needs parsing
-            json_string = response.candidates[0].content.parts[0].text
-            import json
-            return json.loads(json_string)
+            json_string = response.text
+            return orjson.loads(json_string)
+
+        try:
+            return await self._entities_cache.get_or_set(self._cache_key(self.generative_model.model_name, text), extract)
         except Exception as e:
-            print(f"Error extracting entities with Gemini: {e}")
+            logger.error("Error extracting entities with Gemini: %s", e)
             return []
 
-    async def generate_answer(self, question: str, context: str) -> str:
-        """Generates an answer to a question based on provided context."""
-        prompt = f"""Based on the following context, answer the question. If the answer is not explicitly present in the context, state that you don't know or that the information is not available. Do not make up information.
+    @staticmethod
+    def _answer_prompt(question: str, context: str) -> str:
+        """Builds the grounded Q&A prompt shared by generate_answer and stream_answer."""
+        return f"""Based on the following context, answer the question. If the answer is not explicitly present in the context, state that you don't know or that the information is not available. Do not make up information.
 
         Context:
         {context}
@@ -82,22 +281,155 @@ class GeminiService:
 
         Answer:
         """
+
+    async def generate_answer(self, question: str, context: str) -> str:
+        """Generates an answer to a question based on provided context."""
+        prompt = self._answer_prompt(question, context)
         try:
-            response = await self.generative_model.generate_content_async(prompt)
-            return response.candidates[0].content.parts[0].text
+            response = await self.generative_model.generate_content_async(prompt, request_options=REQUEST_OPTIONS)
+            return response.text
         except Exception as e:
-            print(f"Error generating answer with Gemini: {e}")
-            return "I apologize, but I couldn't generate an answer at this time."
+            logger.error("Error generating answer with Gemini: %s", e)
+            return ANSWER_UNAVAILABLE
 
-    async def get_embedding(self, text: str) -> list[float]:
-        """Generates an embedding vector for the given text."""
+    async def create_context_cache(self, text: str) -> str | None:
+        """
+        Caches a document's full text with Gemini context caching and returns the cache name.
+        Returns None if the text is below the caching minimum or the cache can't be created.
+        """
+        # Tokenizing a whole document is CPU-bound, so keep it off the event loop
+        if await asyncio.to_thread(self.count_tokens, text) < CONTEXT_CACHE_MIN_TOKENS:
+            return None
         try:
+            # The caching client is synchronous, so run it in a worker thread
+            cached = await asyncio.to_thread(
+                genai.caching.CachedContent.create,
+                model=CONTEXT_CACHE_MODEL,
+                system_instruction=CONTEXT_CACHE_INSTRUCTION,
+                contents=[text],
+                ttl=CONTEXT_CACHE_TTL
+            )
+            return cached.name
+        except Exception as e:
+            logger.warning("Could not create Gemini context cache: %s", e)
+            return None
+
+    async def _get_cached_model(self, cache_name: str) -> genai.GenerativeModel | None:
+        """
+        Returns a model bound to the named context cache, or None if it can't be loaded right now.
+        Raises ContextCacheExpired if the cache no longer exists.
+        """
+
+        async def load() -> genai.GenerativeModel | None:
+            try:
+                return await asyncio.to_thread(genai.GenerativeModel.from_cached_content, cache_name)
+            except _CONTEXT_CACHE_GONE_ERRORS as e:
+                raise ContextCacheExpired(cache_name) from e
+            except Exception as e:
+                logger.warning("Could not load Gemini context cache %s: %s", cache_name, e)
+                return None
+
+        return await self._cached_models.get_or_set(cache_name, load)
+
+    async def answer_from_context_cache(self, question: str, cache_name: str) -> str | None:
+        """
+        Answers a question against a document held in a Gemini context cache, so only the
+        question is sent. Returns None if the cache is unavailable, so the caller can fall
+        back to generate_answer with retrieved context. Raises ContextCacheExpired if the
+        cache no longer exists, so the caller can also forget its name.
+        """
+        model = await self._get_cached_model(cache_name)
+        if model is None:
+            return None
+        try:
+            response = await model.generate_content_async(
+                f"Question: {question}\n\nAnswer:", request_options=REQUEST_OPTIONS
+            )
+            return response.text
+        except _CONTEXT_CACHE_GONE_ERRORS as e:
+            self._cached_models.invalidate(cache_name)
+            raise ContextCacheExpired(cache_name) from e
+        except Exception as e:
+            logger.warning("Error answering from Gemini context cache: %s", e)
+            self._cached_models.invalidate(cache_name) # Reload (or mark unusable) on the next question
+            return None
+
+    async def stream_answer(self, question: str, context: str) -> AsyncIterator[str]:
+        """Like generate_answer, but yields the answer text as Gemini generates it."""
+        prompt = self._answer_prompt(question, context)
+        try:
+            response = await self.generative_model.generate_content_async(prompt, stream=True)
+            async for chunk in response:
+                if chunk.candidates and chunk.parts:
+                    yield chunk.text
+        except Exception as e:
+            logger.error("Error streaming answer with Gemini: %s", e)
+            yield ANSWER_UNAVAILABLE
+
+    def _embed_locally(self, texts: list[str]) -> list[list[float]]:
+        """Embeds texts with the local model. CPU-bound; call it in a worker thread."""
+        return self.local_embedder.encode(texts, normalize_embeddings=True).tolist()
+
+    async def get_embedding(self, text: str, task_type: str = "RETRIEVAL_DOCUMENT") -> list[float]:
+        """Generates an embedding vector for the given text. Results are cached in-process."""
+
+        async def embed() -> list[float]:
+            if self.local_embedder is not None:
+                # The local model is symmetric, so task_type doesn't apply
+                return (await asyncio.to_thread(self._embed_locally, [text]))[0]
             response = await genai.embed_content_async(
                 model=self.embedding_model,
                 content=text,
-                task_type="RETRIEVAL_DOCUMENT" # Or "RETRIEVAL_QUERY" for queries
+                task_type=task_type, # "RETRIEVAL_QUERY" for questions and search queries
+                request_options=REQUEST_OPTIONS
             )
-            return response['embedding']
+            return _l2_normalize([response['embedding']])[0]
+
+        try:
+            model_name = LOCAL_EMBEDDING_MODEL if self.local_embedder is not None else self.embedding_model
+            cache_key = self._cache_key(f"{model_name}:{task_type}", text)
+            return await self._embedding_cache.get_or_set(cache_key, embed)
         except Exception as e:
-            print(f"Error generating embedding with Gemini: {e}")
+            logger.error("Error generating embedding with Gemini: %s", e)
             raise
+
+    async def get_embeddings_batch(self, texts: list[str], task_type: str = "RETRIEVAL_DOCUMENT") -> list[list[float]]:
+        """
+        Generates embedding vectors for many texts at once.
+        Each batch of up to EMBEDDING_BATCH_SIZE texts is a single API request, and
+        the batches are dispatched concurrently. If the batch form is rejected or unsupported,
+        falls back to concurrent single-text calls; other errors are raised. Output order
+        matches the input order.
+        """
+        if not texts:
+            return []
+        if self.local_embedder is not None:
+            # The model batches internally; one worker thread call covers all texts
+            return await asyncio.to_thread(self._embed_locally, texts)
+        try:
+            batches = [texts[i:i + EMBEDDING_BATCH_SIZE] for i in range(0, len(texts), EMBEDDING_BATCH_SIZE)]
+            responses = await asyncio.gather(*[
+                genai.embed_content_async(
+                    model=self.embedding_model,
+                    content=batch,
+                    task_type=task_type,
+                    request_options=REQUEST_OPTIONS
+                )
+                for batch in batches
+            ])
+            return _l2_normalize([embedding for response in responses for embedding in response['embedding']])
+        except _BATCH_UNSUPPORTED_ERRORS as e:
+            logger.warning("Batch embedding rejected (%s). Falling back to concurrent single-text embeddings.", e)
+
+        semaphore = asyncio.Semaphore(EMBEDDING_CONCURRENCY)
+
+        async def embed_one(text: str) -> list[float]:
+            async with semaphore:
+                return await self.get_embedding(text, task_type=task_type)
+
+        return list(await asyncio.gather(*[embed_one(text) for text in texts]))
+
+@functools.lru_cache(maxsize=1)
+def get_gemini_service() -> GeminiService:
+    """Returns the process-wide GeminiService, so genai.configure and model setup run once."""
+    return GeminiService()
@@ -1,10 +1,54 @@
 import os
+import logging
+import asyncio
+import functools
+from collections import OrderedDict
+import numpy as np
 from supabase import create_client, Client
 from dotenv import load_dotenv
 from typing import List, Dict, Any
 
+from services.db_pool import get_pool
+from services.cache import AsyncLRUCache
+
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
+# In-memory brute-force search for repeatedly searched documents: a document's embeddings
+# are loaded on its LOCAL_SEARCH_MIN_SEARCHES-th search, documents above
+# LOCAL_SEARCH_MAX_CHUNKS always use pgvector, and the cached matrices and texts are
+# bounded by EMBEDDING_CACHE_MAX_BYTES per process. Scans over more than
+# LOCAL_SEARCH_THREAD_ROWS rows run in a worker thread to keep the event loop free.
+EMBEDDING_CACHE_DOCUMENTS = 32
+EMBEDDING_CACHE_MAX_BYTES = int(os.environ.get("EMBEDDING_CACHE_MAX_MB", 256)) * 1024 * 1024
+LOCAL_SEARCH_MIN_SEARCHES = 2
+LOCAL_SEARCH_MAX_CHUNKS = 20_000
+LOCAL_SEARCH_THREAD_ROWS = 4_096
+SEARCH_COUNT_DOCUMENTS = 4_096
+
+def _embedding_cache_weight(entry: tuple[np.ndarray, list[str]] | None) -> int:
+    """Approximate bytes held by a cached (embedding matrix, chunk texts) entry."""
+    if entry is None:
+        return 0
+    matrix, texts = entry
+    return matrix.nbytes + sum(len(text) for text in texts)
+
+def _rank_chunks(matrix: np.ndarray, texts: list[str], query: np.ndarray, top_k: int) -> list[str]:
+    """Returns the texts of the top_k rows of matrix by inner product with query, best first."""
+    similarities = matrix @ query
+    k = min(top_k, len(texts))
+    top = np.argpartition(-similarities, k - 1)[:k]
+    top = top[np.argsort(-similarities[top])]
+    return [texts[i] for i in top]
+
+def _build_embedding_matrix(embeddings: list[np.ndarray]) -> np.ndarray:
+    """Stacks embeddings into an L2-normalized float32 matrix."""
+    matrix = np.vstack(embeddings).astype(np.float32)
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    matrix /= np.where(norms == 0, 1, norms)
+    return matrix
+
 class SupabaseService:
     def __init__(self):
         self.url: str = os.environ.get("SUPABASE_URL")
@@ -12,6 +56,15 @@ class SupabaseService:
         if not self.url or not self.key:
             raise ValueError("Supabase URL and Key must be set in environment variables.")
         self.client: Client = create_client(self.url, self.key)
+        # Per-document (embedding matrix, chunk texts); expires so other workers' writes are picked up
+        self._emb_cache = AsyncLRUCache(
+            maxsize=EMBEDDING_CACHE_DOCUMENTS, ttl=600,
+            max_weight=EMBEDDING_CACHE_MAX_BYTES, weigh=_embedding_cache_weight
+        )
+        # Recent search counts per document, to load only repeatedly searched documents
+        self._search_counts: OrderedDict[str, int] = OrderedDict()
+        # Gemini context cache names per document, so each question doesn't re-read the row
+        self._context_cache_names = AsyncLRUCache(maxsize=1024, ttl=300)
 
     async def upload_pdf_to_storage(self, file_name: str, file_content: bytes, user_id: str) -> str:
         """Uploads a PDF file to Supabase Storage."""
@@ -19,17 +72,15 @@ class SupabaseService:
             # Store in a user-specific folder
             path_in_storage = f"documents/{user_id}/{file_name}"
             
-            # The .upload() method returns an UploadResponse object
-            response = self.client.storage.from_("documents").upload(path_in_storage, file_content, {"content-type": "application/pdf"})
-
-            # --- DEBUGGING OUTPUT ---
-            # These print statements will help you inspect the 'response' object
-            # if you encounter further issues. You can remove them once it's working.
-            print(f"DEBUG: Supabase upload response type: {type(response)}")
-            print(f"DEBUG: Supabase upload response content: {response}")
-            if hasattr(response, '__dict__'):
-                print(f"DEBUG: Supabase upload response __dict__: {response.__dict__}")
-            # --- END DEBUGGING OUTPUT ---
+            # The .upload() method returns an UploadResponse object.
+            # The client is synchronous, so run it in a worker thread to avoid blocking the event loop.
+            response = await asyncio.to_thread(
+                self.client.storage.from_("documents").upload,
+                path_in_storage, file_content, {"content-type": "application/pdf"}
+            )
+
+            # Formatted only when debug logging is enabled
+            logger.debug("Supabase upload response: %r", response)
 
             # Attempt 1: Check if 'path' is a direct attribute of the response object
             # This is less common for supabase-py v2.x but good to check.
@@ -53,7 +104,7 @@ class SupabaseService:
                             f"Attributes: {response.__dict__ if hasattr(response, '__dict__') else 'N/A'}")
 
         except Exception as e:
-            print(f"Error uploading PDF to Supabase Storage: {e}")
+            logger.error("Error uploading PDF to Supabase Storage: %s", e)
             raise
 
     async def insert_document_metadata(self, user_id: str, filename: str, storage_path: str,
@@ -101,7 +152,7 @@ class SupabaseService:
 
             raise Exception(f"Failed to insert document metadata. Response: {res}")
         except Exception as e:
-            print(f"Error inserting document metadata: {e}")
+            logger.error("Error inserting document metadata: %s", e)
             raise
 
     async def get_document_by_id(self, document_id: str) -> Dict[str, Any] | None:
@@ -110,6 +161,11 @@ class SupabaseService:
         Handles multiple response shapes returned by different supabase/pysupabase versions.
         """
         try:
+            pool = await get_pool()
+            if pool is not None:
+                # to_jsonb gives the row the same JSON shape PostgREST would return
+                return await pool.fetchval("SELECT to_jsonb(d) FROM documents d WHERE d.id = $1::uuid", document_id)
+
             res = self.client.table("documents").select("*").eq("id", document_id).single().execute()
 
             # If the client returns a SingleAPIResponse (postgrest), it will have .data
@@ -142,7 +198,7 @@ class SupabaseService:
 
             return None
         except Exception as e:
-            print(f"Error fetching document by id {document_id}: {e}")
+            logger.error("Error fetching document by id %s: %s", document_id, e)
             raise
 
     async def get_document_chunks(self, document_id: str, top_k: int = 10) -> List[Dict[str, Any]]:
@@ -152,9 +208,9 @@ class SupabaseService:
         """
         try:
             res = self.client.table("document_chunks")\
-                .select("*")\
+                .select("chunk_index, chunk_text")\
                 .eq("document_id", document_id)\
-                .order("chunk_index", {"ascending": True})\
+                .order("chunk_index")\
                 .limit(top_k)\
                 .execute()
 
@@ -183,16 +239,51 @@ class SupabaseService:
 
             return []
         except Exception as e:
-            print(f"Error fetching chunks for document {document_id}: {e}")
+            logger.error("Error fetching chunks for document %s: %s", document_id, e)
             raise
 
 
+    # Chunk indexing state per document, written when the indexing background task ends.
+    # Requires:
+    # ALTER TABLE documents ADD COLUMN index_status text NOT NULL DEFAULT 'indexing'
+    #   CHECK (index_status IN ('indexing', 'ready', 'failed'));
+    # Documents indexed before the column existed:
+    # UPDATE documents d SET index_status = 'ready'
+    #   WHERE EXISTS (SELECT 1 FROM document_chunks c WHERE c.document_id = d.id);
+    async def set_index_status(self, document_id: str, index_status: str):
+        """Records a document's indexing state ('indexing', 'ready' or 'failed')."""
+        try:
+            pool = await get_pool()
+            if pool is not None:
+                await pool.execute(
+                    "UPDATE documents SET index_status = $2 WHERE id = $1::uuid", document_id, index_status
+                )
+            else:
+                self.client.table("documents").update({"index_status": index_status}).eq("id", document_id).execute()
+        except Exception as e:
+            logger.error("Error setting index status of document %s: %s", document_id, e)
+        finally:
+            # Anything cached while the document was being indexed may be partial
+            self._emb_cache.invalidate(document_id)
+
+    async def get_index_status(self, document_id: str) -> str | None:
+        """Returns a document's indexing state, or None if the document doesn't exist."""
+        try:
+            pool = await get_pool()
+            if pool is not None:
+                return await pool.fetchval("SELECT index_status FROM documents WHERE id = $1::uuid", document_id)
+            res = self.client.table("documents").select("index_status").eq("id", document_id).limit(1).execute()
+            return res.data[0].get("index_status") if res.data else None
+        except Exception as e:
+            logger.error("Error reading index status of document %s: %s", document_id, e)
+            raise
+
     async def get_document_text_path(self, document_id: str) -> str:
         """Retrieves the extracted text path for a given document ID."""
         # This method would be used if you stored extracted text in storage.
         # Currently, we're assuming extracted text is small enough to be processed directly.
         # If you re-implement storing large extracted text files, this method would be relevant.
-        print("Warning: get_document_text_path is called but extracted_text is not stored in storage in current setup.")
+        logger.warning("get_document_text_path is called but extracted_text is not stored in storage in current setup.")
         return None # Placeholder
 
     async def download_text_from_storage(self, path: str) -> str:
@@ -200,19 +291,39 @@ class SupabaseService:
         # This method would be used if you stored extracted text in storage.
         # Currently, we're assuming extracted text is small enough to be processed directly.
         # If you re-implement storing large extracted text files, this method would be relevant.
-        print("Warning: download_text_from_storage is called but extracted_text is not stored in storage in current setup.")
+        logger.warning("download_text_from_storage is called but extracted_text is not stored in storage in current setup.")
         return "" # Placeholder
 
     async def insert_document_chunks(self, document_id: str, chunks: list[dict]):
         """Inserts document chunks with embeddings into the 'document_chunks' table."""
         try:
-            # Ensure chunks have document_id and embedding
-            for chunk in chunks:
-                chunk['document_id'] = document_id
-            data, count = self.client.table('document_chunks').insert(chunks).execute()
+            if not chunks:
+                return None
+
+            self._emb_cache.invalidate(document_id)
+            pool = await get_pool()
+            if pool is not None:
+                # One multi-row INSERT: the rows travel as parallel arrays and are expanded server-side.
+                # Embeddings are converted to FP16 in one vectorized step, already in the big-endian
+                # layout the binary halfvec codec sends, so each row encodes without another copy.
+                embeddings = np.asarray([chunk['embedding'] for chunk in chunks], dtype=">f2")
+                await pool.execute(
+                    "INSERT INTO document_chunks (document_id, chunk_index, chunk_text, embedding) "
+                    "SELECT $1::uuid, ci, ct, ce "
+                    "FROM UNNEST($2::int[], $3::text[], $4::halfvec[]) AS t(ci, ct, ce)",
+                    document_id,
+                    [chunk['chunk_index'] for chunk in chunks],
+                    [chunk['chunk_text'] for chunk in chunks],
+                    list(embeddings)
+                )
+                return None
+
+            # PostgREST accepts an array body, so all rows go in a single request
+            rows = [{**chunk, 'document_id': document_id} for chunk in chunks]
+            data, count = self.client.table('document_chunks').insert(rows).execute()
             return data
         except Exception as e:
-            print(f"Error inserting document chunks: {e}")
+            logger.error("Error inserting document chunks: %s", e)
             raise
 
     async def get_relevant_chunks(self, document_id: str, query_embedding: list, top_k: int = 5) -> list[str]:
@@ -221,23 +332,64 @@ class SupabaseService:
             # IMPORTANT: This requires a Supabase RPC function named 'match_document_chunks'
             # to be created in your Supabase SQL Editor.
             # Example RPC SQL:
-            # CREATE OR REPLACE FUNCTION match_document_chunks(query_embedding vector(768), match_count int, doc_id uuid)
+            # CREATE OR REPLACE FUNCTION match_document_chunks(query_embedding halfvec(768), match_count int, doc_id uuid)
             # RETURNS TABLE (id uuid, document_id uuid, chunk_text text, similarity float)
             # LANGUAGE plpgsql
             # AS $$
             # BEGIN
+            #   -- Size the HNSW candidate list to the request: 40 for Q&A (top_k=5),
+            #   -- 80 for semantic search (top_k=10). Applies to this transaction only.
+            #   PERFORM set_config('hnsw.ef_search', greatest(40, match_count * 8)::text, true);
+            #   -- The index is shared by all documents, so the document_id filter is applied to
+            #   -- its candidates. Iterative scans (pgvector >= 0.8) keep scanning until enough
+            #   -- rows of this document are found, instead of returning fewer than match_count.
+            #   -- relaxed_order may return candidates slightly out of order, so re-sort them.
+            #   PERFORM set_config('hnsw.iterative_scan', 'relaxed_order', true);
             #   RETURN QUERY
-            #   SELECT
-            #     document_chunks.id,
-            #     document_chunks.document_id,
-            #     document_chunks.chunk_text,
-            #     1 - (document_chunks.embedding <=> query_embedding) AS similarity
-            #   FROM document_chunks
-            #   WHERE document_chunks.document_id = doc_id
-            #   ORDER BY document_chunks.embedding <=> query_embedding
-            #   LIMIT match_count;
+            #   WITH candidates AS MATERIALIZED (
+            #     SELECT
+            #       document_chunks.id,
+            #       document_chunks.document_id,
+            #       document_chunks.chunk_text,
+            #       -(document_chunks.embedding <#> query_embedding)::float AS similarity
+            #     FROM document_chunks
+            #     WHERE document_chunks.document_id = doc_id
+            #     ORDER BY document_chunks.embedding <#> query_embedding
+            #     LIMIT match_count
+            #   )
+            #   SELECT * FROM candidates ORDER BY candidates.similarity DESC;
             # END;
             # $$;
+            #
+            # Embeddings are stored as FP16 halfvec, which halves the bytes scanned per distance,
+            # and the search is served by an HNSW index (replacing IVFFlat):
+            # DROP INDEX IF EXISTS document_chunks_embedding_idx; -- the old IVFFlat index, if any
+            # DROP INDEX IF EXISTS document_chunks_embedding_hnsw;
+            # ALTER TABLE document_chunks ALTER COLUMN embedding TYPE halfvec(768) USING embedding::halfvec(768);
+            # CREATE INDEX document_chunks_embedding_hnsw ON document_chunks
+            #   USING hnsw (embedding halfvec_ip_ops) WITH (m = 16, ef_construction = 64);
+            #
+            # Embeddings are L2-normalized before they are stored or queried, so the inner
+            # product equals cosine similarity and <#> (negative inner product) skips the
+            # per-comparison normalization <=> does. Rows stored before normalization:
+            # UPDATE document_chunks SET embedding = l2_normalize(embedding);
+            #
+            # A btree index on document_id lets the planner search a single document exactly
+            # (filter, then sort its chunks) when that is cheaper than the HNSW scan. On
+            # pgvector < 0.8, drop the iterative_scan line above and rely on this index:
+            # CREATE INDEX document_chunks_document_id_idx ON document_chunks (document_id);
+
+            local_chunks = await self._search_local_embeddings(document_id, query_embedding, top_k)
+            if local_chunks is not None:
+                return local_chunks
+
+            pool = await get_pool()
+            if pool is not None:
+                rows = await pool.fetch(
+                    "SELECT chunk_text FROM match_document_chunks($1::halfvec, $2, $3::uuid)",
+                    np.asarray(query_embedding, dtype=np.float16), top_k, document_id
+                )
+                return [row['chunk_text'] for row in rows]
 
             data, count = self.client.rpc('match_document_chunks', {
                 'query_embedding': query_embedding,
@@ -249,10 +401,176 @@ class SupabaseService:
                 return [item['chunk_text'] for item in data[1]]
             return []
         except Exception as e:
-            print(f"Error retrieving relevant chunks from Supabase: {e}")
+            logger.error("Error retrieving relevant chunks from Supabase: %s", e)
             # Fallback or raise error
             return []
 
+    async def _load_document_embeddings(self, document_id: str) -> tuple[np.ndarray, list[str]] | None:
+        """
+        Loads all chunk embeddings of a fully indexed document as an L2-normalized float32
+        matrix, with the chunk texts in the same order. Returns None if the document isn't
+        indexed yet, has no chunks, or is too large to search in memory.
+        """
+        pool = await get_pool()
+        rows = await pool.fetch(
+            "SELECT c.chunk_text, c.embedding FROM document_chunks c "
+            "JOIN documents d ON d.id = c.document_id AND d.index_status = 'ready' "
+            "WHERE c.document_id = $1::uuid ORDER BY c.chunk_index LIMIT $2",
+            document_id, LOCAL_SEARCH_MAX_CHUNKS + 1
+        )
+        if not rows or len(rows) > LOCAL_SEARCH_MAX_CHUNKS:
+            return None
+        matrix = await asyncio.to_thread(_build_embedding_matrix, [row['embedding'] for row in rows])
+        return matrix, [row['chunk_text'] for row in rows]
+
+    def _record_search(self, document_id: str) -> int:
+        """Counts a search of the document and returns its recent search count."""
+        count = self._search_counts.pop(document_id, 0) + 1
+        self._search_counts[document_id] = count
+        while len(self._search_counts) > SEARCH_COUNT_DOCUMENTS:
+            self._search_counts.popitem(last=False)
+        return count
+
+    async def _search_local_embeddings(self, document_id: str, query_embedding: list, top_k: int) -> list[str] | None:
+        """
+        Brute-force cosine search over the document's in-memory embedding matrix, which is
+        loaded once the document has been searched repeatedly. Later searches of the same
+        document skip the database entirely. Returns None when the document isn't searchable
+        in memory (no pool, not searched enough, too large, not indexed) or the search fails,
+        so the caller falls back to pgvector.
+        """
+        try:
+            if await get_pool() is None:
+                return None
+            cached = self._emb_cache.get(document_id)
+            if cached is None:
+                if self._record_search(document_id) < LOCAL_SEARCH_MIN_SEARCHES:
+                    return None
+                cached = await self._emb_cache.get_or_set(
+                    document_id, lambda: self._load_document_embeddings(document_id)
+                )
+                if cached is None:
+                    return None
+            matrix, texts = cached
+            query = np.asarray(query_embedding, dtype=np.float32)
+            if len(texts) > LOCAL_SEARCH_THREAD_ROWS:
+                return await asyncio.to_thread(_rank_chunks, matrix, texts, query, top_k)
+            return _rank_chunks(matrix, texts, query, top_k)
+        except Exception as e:
+            logger.warning("In-memory search failed for document %s, using pgvector: %s", document_id, e)
+            return None
+
+    # Content-addressed reuse of chunks and embeddings for re-uploaded text.
+    # Requires this table (lookups and writes are skipped when it or the pool is missing):
+    # CREATE TABLE document_text_cache (
+    #   content_hash text PRIMARY KEY,
+    #   document_id uuid NOT NULL REFERENCES documents(id) ON DELETE CASCADE
+    # );
+
+    async def get_cached_document_id(self, content_hash: str) -> str | None:
+        """Returns the ID of an already-indexed document with the same text hash, if any."""
+        pool = await get_pool()
+        if pool is None:
+            return None
+        try:
+            document_id = await pool.fetchval(
+                "SELECT document_id FROM document_text_cache WHERE content_hash = $1", content_hash
+            )
+            return str(document_id) if document_id else None
+        except Exception as e:
+            logger.warning("Document text cache lookup failed: %s", e)
+            return None
+
+    async def copy_document_chunks(self, source_document_id: str, target_document_id: str) -> int:
+        """Copies all chunks and embeddings of one document to another in a single statement. Returns the row count."""
+        pool = await get_pool()
+        if pool is None:
+            return 0
+        self._emb_cache.invalidate(target_document_id)
+        try:
+            status = await pool.execute(
+                "INSERT INTO document_chunks (document_id, chunk_index, chunk_text, embedding) "
+                "SELECT $1::uuid, chunk_index, chunk_text, embedding FROM document_chunks WHERE document_id = $2::uuid",
+                target_document_id, source_document_id
+            )
+            return int(status.split()[-1]) # Status looks like "INSERT 0 <rows>"
+        except Exception as e:
+            logger.warning("Copying chunks from document %s failed: %s", source_document_id, e)
+            return 0
+
+    async def cache_document_text(self, content_hash: str, document_id: str):
+        """Records that document_id holds the indexed chunks for the given text hash."""
+        pool = await get_pool()
+        if pool is None:
+            return
+        try:
+            await pool.execute(
+                "INSERT INTO document_text_cache (content_hash, document_id) VALUES ($1, $2::uuid) "
+                "ON CONFLICT (content_hash) DO NOTHING",
+                content_hash, document_id
+            )
+        except Exception as e:
+            logger.warning("Document text cache write failed: %s", e)
+
+    async def get_relevant_context(self, document_id: str, query_embedding: list, top_k: int = 5,
+                                   separator: str = "\n\n") -> str:
+        """
+        Returns the most relevant document chunks joined into a single context string.
+        With the connection pool, the join happens in Postgres (string_agg), so only
+        one value comes back. Returns an empty string if nothing matches.
+        """
+        pool = await get_pool()
+        if pool is None:
+            return separator.join(await self.get_relevant_chunks(document_id, query_embedding, top_k=top_k))
+        try:
+            local_chunks = await self._search_local_embeddings(document_id, query_embedding, top_k)
+            if local_chunks is not None:
+                return separator.join(local_chunks)
+            context = await pool.fetchval(
+                "SELECT string_agg(chunk_text, $4 ORDER BY similarity DESC) "
+                "FROM match_document_chunks($1::halfvec, $2, $3::uuid)",
+                np.asarray(query_embedding, dtype=np.float16), top_k, document_id, separator
+            )
+            return context or ""
+        except Exception as e:
+            logger.error("Error retrieving relevant context from Supabase: %s", e)
+            return ""
+
+    # Gemini context cache name for a document's full text (see GeminiService.create_context_cache).
+    # Requires: ALTER TABLE documents ADD COLUMN gemini_cache_handle text;
+    async def set_context_cache_name(self, document_id: str, cache_name: str | None):
+        """Stores the Gemini context cache name for a document, or clears it with None."""
+        try:
+            pool = await get_pool()
+            if pool is not None:
+                await pool.execute(
+                    "UPDATE documents SET gemini_cache_handle = $2 WHERE id = $1::uuid", document_id, cache_name
+                )
+            else:
+                self.client.table("documents").update({"gemini_cache_handle": cache_name}).eq("id", document_id).execute()
+            self._context_cache_names.invalidate(document_id)
+        except Exception as e:
+            logger.warning("Could not store context cache name for document %s: %s", document_id, e)
+
+    async def get_context_cache_name(self, document_id: str) -> str | None:
+        """Returns the Gemini context cache name stored for a document, or None if it has none."""
+
+        async def fetch() -> str | None:
+            try:
+                pool = await get_pool()
+                if pool is not None:
+                    return await pool.fetchval(
+                        "SELECT gemini_cache_handle FROM documents WHERE id = $1::uuid", document_id
+                    )
+                res = self.client.table("documents").select("gemini_cache_handle").eq("id", document_id).limit(1).execute()
+                return res.data[0].get("gemini_cache_handle") if res.data else None
+            except Exception as e:
+                # Cached as None, so a missing column doesn't cost a failed query per question
+                logger.warning("Could not read context cache name for document %s: %s", document_id, e)
+                return None
+
+        return await self._context_cache_names.get_or_set(document_id, fetch)
+
     async def save_conversation(self, user_id: str, document_id: str, user_message: str, ai_response: str):
         """Saves a conversation turn to the 'conversations' table."""
         try:
@@ -264,16 +582,32 @@ class SupabaseService:
             }).execute()
             return data
         except Exception as e:
-            print(f"Error saving conversation: {e}")
+            logger.error("Error saving conversation: %s", e)
             raise
 
-    async def get_user_documents(self, user_id: str) -> List[Dict[str, Any]]:
-        """Retrieves a list of document IDs and filenames for a given user."""
+    async def get_user_documents(self, user_id: str, limit: int | None = None, offset: int = 0) -> List[Dict[str, Any]]:
+        """
+        Retrieves document IDs and filenames for a given user, newest first.
+        With `limit`, returns one page starting at `offset`; without it, returns all documents.
+        """
         try:
-            data, count = self.client.table('documents').select('id, filename').eq('user_id', user_id).execute()
+            query = self.client.table('documents')\
+                .select('id, filename')\
+                .eq('user_id', user_id)\
+                .order('created_at', desc=True)
+            if limit is not None:
+                query = query.range(offset, offset + limit - 1)
+            elif offset:
+                query = query.offset(offset)
+            data, count = query.execute()
             if data and data[1]:
                 return data[1] # data[1] contains the list of dictionaries
             return []
         except Exception as e:
-            print(f"Error retrieving documents for user {user_id}: {e}")
-            raise
\ No newline at end of file
+            logger.error("Error retrieving documents for user %s: %s", user_id, e)
+            raise
+
+@functools.lru_cache(maxsize=1)
+def get_supabase_service() -> SupabaseService:
+    """Returns the process-wide SupabaseService, so the client and its caches are created once."""
+    return SupabaseService()
@@ -164,7 +164,9 @@ const DocuMateApp = () => {
       });
 
       if (!response.ok) {
-        throw new Error(`Question failed: ${response.statusText}`);
+        // 409 means the document is still being indexed; the detail says so
+        const body = await response.json().catch(() => ({}));
+        throw new Error(body.detail || response.statusText);
       }
 
       const data = await response.json();
@@ -203,7 +205,9 @@ const DocuMateApp = () => {
       });
 
       if (!response.ok) {
-        throw new Error(`Search failed: ${response.statusText}`);
+        // 409 means the document is still being indexed; the detail says so
+        const body = await response.json().catch(() => ({}));
+        throw new Error(body.detail || response.statusText);
       }
 
       const data = await response.json();